@@ -1,15 +1,19 @@
-import sqlite3
+import importlib.util
+import json
 import tempfile
 
-from django.contrib import admin
-from django.db.models import OuterRef, Subquery, Count
-from django.http.response import HttpResponse
+from django.contrib import admin, messages
+from django.shortcuts import redirect
+from django.http.response import FileResponse, HttpResponse, StreamingHttpResponse
+from django.template.response import TemplateResponse
 from django.urls import path, reverse
 from django.utils.html import format_html
 from django.utils.html import mark_safe
 
-from .models import Spider, Execution, Item
-from .tasks import run_spider
+from .exports import iter_csv, iter_jsonl, iter_samples_csv, iter_spider_samples_csv, write_parquet, write_sqlite, write_xlsx
+from .forms import SpiderTestForm
+from .models import Spider, Execution, ExecutionProfile, Item, CrawlRequest, SeenRequest, CachedResponse
+from .tasks import queue_spider
 
 
 def dict_to_html_table(d):
@@ -23,17 +27,14 @@ def dict_to_html_table(d):
 class ExecutionInline(admin.TabularInline):
     model = Execution
 
-    def num_items_scraped(self, obj):
-        return obj.num_items
-
     fields = [
         'time_started',
-        'num_items_scraped',
+        'item_count',
 
     ]
     readonly_fields = [
         'time_started',
-        'num_items_scraped',
+        'item_count',
 
     ]
     max_num = 20
@@ -43,25 +44,33 @@ class ExecutionInline(admin.TabularInline):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.order_by('-time_started').annotate(num_items=Count('item'))
+        return qs.defer('log_data').order_by('-time_started')
 
 
 class SpiderAdmin(admin.ModelAdmin):
 
-    def last_execution(self, obj):
-        return obj.last_execution_time
-
-    def last_finish(self, obj):
-        return obj.last_finish_reason
+    def last_execution_time(self, obj):
+        return obj.last_execution.time_started if obj.last_execution else None
 
-    def num_executions(self, obj):
-        return obj.num_executions
+    last_execution_time.short_description = 'Last execution'
 
     def schedule_for_execution(self, request, qs):
         for obj in qs:
-            run_spider.delay(obj.id)
+            queue_spider(obj.id)
         self.message_user(request, f'{len(qs)} spiders scheduled for execution')
 
+    def queue_for_crawl_worker(self, request, qs):
+        CrawlRequest.objects.bulk_create([CrawlRequest(spider=obj) for obj in qs])
+        self.message_user(request, f'{len(qs)} spiders queued for the crawl worker')
+
+    def clear_seen_requests(self, request, qs):
+        n, _ = SeenRequest.objects.filter(spider__in=qs).delete()
+        self.message_user(request, f'{n} seen requests cleared')
+
+    def clear_http_cache(self, request, qs):
+        n, _ = CachedResponse.objects.filter(spider__in=qs).delete()
+        self.message_user(request, f'{n} cached responses cleared')
+
     def set_active(self, request, qs):
         qs.update(active=True)
         n = qs.count()
@@ -77,9 +86,11 @@ class SpiderAdmin(admin.ModelAdmin):
         'id',
         'name',
         'active',
-        'num_executions',
-        'last_execution',
-        'last_finish',
+        'execution_count',
+        'last_execution_time',
+        'last_finish_reason',
+        'next_run_at',
+        'samples_markup',
     ]
 
     list_filter = [
@@ -88,6 +99,9 @@ class SpiderAdmin(admin.ModelAdmin):
 
     actions = [
         'schedule_for_execution',
+        'queue_for_crawl_worker',
+        'clear_seen_requests',
+        'clear_http_cache',
         'set_active',
         'set_inactive',
     ]
@@ -98,24 +112,103 @@ class SpiderAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.annotate(
-            last_execution_time=Subquery(Execution.objects.filter(spider_id=OuterRef('id')).order_by('-time_started').values('time_started')[:1]),
-            last_finish_reason=Subquery(Execution.objects.filter(spider_id=OuterRef('id')).order_by('-time_started').values('stats__finish_reason')[:1]),
-            num_executions=Count('execution'),
+        return qs.select_related('last_execution').defer('last_execution__log_data')
+
+    def samples_markup(self, obj):
+        return format_html(
+            '<a class="button" download href="{}">Throughput CSV</a>',
+            reverse('admin:scratchy_spider_download_samples', args=[obj.pk]),
         )
 
+    samples_markup.short_description = 'Throughput'
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                '<int:pk>/download/samples/',
+                self.admin_site.admin_view(self.download_samples),
+                name='scratchy_spider_download_samples',
+            ),
+            path(
+                'test/',
+                self.admin_site.admin_view(self.test_scrape),
+                name='scratchy_spider_test',
+            ),
+        ]
+        return custom_urls + urls
+
+    def download_samples(self, request, pk):
+        spider = self.model.objects.get(id=pk)
+        response = StreamingHttpResponse(iter_spider_samples_csv(spider), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename={spider.name}_throughput.csv'
+        return response
+
+    change_list_template = 'admin/scratchy/spider/change_list.html'
+
+    def test_scrape(self, request):
+        result = None
+        if request.method == 'POST':
+            form = SpiderTestForm(request.POST)
+            if form.is_valid():
+                result = form.scrape()
+        else:
+            form = SpiderTestForm(initial={'spider': request.GET.get('spider')})
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Test scrape',
+            'form': form,
+            'result': result,
+            'item_json': json.dumps(result['item'], indent=2, ensure_ascii=False) if result and result['item'] is not None else '',
+        }
+        return TemplateResponse(request, 'admin/scratchy/spider/test_scrape.html', context)
+
+
+class RunningListFilter(admin.SimpleListFilter):
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return [
+            ('queued', 'Queued'),
+            ('running', 'Running'),
+            ('ended', 'Ended'),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'queued':
+            return queryset.filter(time_started__isnull=True, time_ended__isnull=True)
+        if self.value() == 'running':
+            return queryset.filter(time_started__isnull=False, time_ended__isnull=True)
+        if self.value() == 'ended':
+            return queryset.filter(time_ended__isnull=False)
+        return queryset
+
+
+def get_file_name(execution, suffix):
+    """
+    Download file name of an execution, queued executions have no start time yet.
+    """
+    timestamp = execution.time_started or execution.time_queued
+    return f'{execution.spider.name}_{timestamp.strftime("%Y-%m-%d") if timestamp else execution.pk}{suffix}'
+
 
 class ExecutionAdmin(admin.ModelAdmin):
 
-    def num_items(self, obj):
-        return obj.num_items_scraped
+    def items_per_second(self, obj):
+        return obj.items_per_second
+
+    items_per_second.short_description = 'Items/sec'
 
     list_display = [
         'time_started',
         'spider',
         'time_ended',
         'responses',
-        'num_items',
+        'item_count',
+        'items_per_second',
         'seconds',
         'finish_reason',
         'download_size',
@@ -123,77 +216,168 @@ class ExecutionAdmin(admin.ModelAdmin):
     ]
 
     list_filter = [
+        RunningListFilter,
         'spider',
     ]
 
     fields = [
         'spider',
+        'time_queued',
         'time_started',
         'time_ended',
+        'time_heartbeat',
+        'item_count',
         'stats_table',
-        'log',
+        'samples',
+        'profile_download',
+        'log_tail',
     ]
 
     date_hierarchy = 'time_started'
 
     readonly_fields = [
         'spider',
+        'time_queued',
         'time_started',
         'time_ended',
+        'time_heartbeat',
+        'item_count',
         'stats_table',
-        'log',
+        'samples',
+        'profile_download',
+        'log_tail',
     ]
 
     def stats_table(self, obj):
         return dict_to_html_table(obj.stats)
 
+    def log_tail(self, obj):
+        return format_html(
+            '<a class="button" download href="{}">Download full log</a><pre>{}</pre>',
+            reverse('admin:scratchy_execution_download_log', args=[obj.pk]),
+            obj.log_tail(),
+        )
+
+    log_tail.short_description = 'Log (last 200 lines)'
+
+    def samples(self, obj):
+        return format_html(
+            '{} samples <a class="button" download href="{}">Download CSV</a>',
+            obj.executionsample_set.count(),
+            reverse('admin:scratchy_execution_download_samples', args=[obj.pk]),
+        )
+
+    samples.short_description = 'Throughput samples'
+
+    def profile_download(self, obj):
+        if not ExecutionProfile.objects.filter(execution=obj).exists():
+            return '-'
+        return format_html(
+            '<a class="button" download href="{}">Download cProfile output</a>',
+            reverse('admin:scratchy_execution_download_profile', args=[obj.pk]),
+        )
+
+    profile_download.short_description = 'Profile'
+
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.select_related('spider').annotate(
-            num_items_scraped=Count('item')
-        )
+        return qs.select_related('spider').defer('log_data')  # log is loaded on demand
 
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
             path(
-                '<int:pk>/download/excel/',
-                self.admin_site.admin_view(self.download('excel')),
-                name='scratchy_execution_download_excel',
+                f'<int:pk>/download/{format}/',
+                self.admin_site.admin_view(self.download(format)),
+                name=f'scratchy_execution_download_{format}',
+            )
+            for format in self.download_formats
+        ] + [
+            path(
+                '<int:pk>/download/log/',
+                self.admin_site.admin_view(self.download_log),
+                name='scratchy_execution_download_log',
             ),
             path(
-                '<int:pk>/download/sqlite/',
-                self.admin_site.admin_view(self.download('sqlite')),
-                name='scratchy_execution_download_sqlite',
+                '<int:pk>/download/samples/',
+                self.admin_site.admin_view(self.download_samples),
+                name='scratchy_execution_download_samples',
+            ),
+            path(
+                '<int:pk>/download/profile/',
+                self.admin_site.admin_view(self.download_profile),
+                name='scratchy_execution_download_profile',
             ),
         ]
         return custom_urls + urls
 
+    def download_log(self, request, pk):
+        execution = self.model.objects.select_related('spider').only('log_data', 'time_started', 'time_queued', 'spider__name').get(id=pk)
+        response = StreamingHttpResponse(execution.iter_log(), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename={get_file_name(execution, ".log")}'
+        return response
+
+    def download_samples(self, request, pk):
+        execution = self.model.objects.select_related('spider').defer('log_data').get(id=pk)
+        response = StreamingHttpResponse(iter_samples_csv(execution), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename={get_file_name(execution, "_samples.csv")}'
+        return response
+
+    def download_profile(self, request, pk):
+        profile = ExecutionProfile.objects.select_related('execution__spider').defer('execution__log_data').get(execution_id=pk)
+        response = HttpResponse(profile.get_stats_data(), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename={get_file_name(profile.execution, ".prof")}'
+        return response
+
+    download_formats = [
+        'excel',
+        'csv',
+        'jsonl',
+        'sqlite',
+        'parquet',
+    ]
+
     def download(self, format):
         def view(request, pk):
 
-            response = HttpResponse()
-            execution = self.model.objects.select_related('spider').get(id=pk)
+            execution = self.model.objects.select_related('spider').defer('log_data').get(id=pk)
             extension = ''
             content_type = ''
 
             if format == 'excel':
-                df = execution.items_as_df(stringify_datetime=True)
-                df.to_excel(response, index=False)
+                t = tempfile.NamedTemporaryFile(suffix='.xlsx')
+                write_xlsx(execution, t)
+                t.seek(0)
+                response = FileResponse(t)  # closes and removes the file when done
                 content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
                 extension = 'xlsx'
+            elif format == 'csv':
+                response = StreamingHttpResponse(iter_csv(execution))
+                content_type = 'text/csv; charset=utf-8'
+                extension = 'csv'
+            elif format == 'jsonl':
+                response = StreamingHttpResponse(iter_jsonl(execution))
+                content_type = 'application/x-ndjson; charset=utf-8'
+                extension = 'jsonl'
             elif format == 'sqlite':
-                df = execution.items_as_df()
-                t = tempfile.NamedTemporaryFile()
-                conn = sqlite3.connect(t.name)
-                df.to_sql('items', conn, index=False)
-                conn.close()
-                response.write(t.read())
-                t.close()
+                t = tempfile.NamedTemporaryFile(suffix='.sqlite3')
+                write_sqlite(execution, t.name)
+                response = FileResponse(t)
                 extension = 'sqlite3'
                 content_type = 'application/octet-stream'
-
-            response['Content-Disposition'] = f'attachment; filename={execution.spider.name}_{execution.time_started.strftime("%Y-%m-%d")}.{extension}'
+            elif format == 'parquet':
+                t = tempfile.NamedTemporaryFile(suffix='.parquet')
+                try:
+                    write_parquet(execution, t.name)
+                except ImportError:
+                    t.close()
+                    self.message_user(request, 'Parquet export requires pyarrow', level=messages.ERROR)
+                    return redirect('admin:scratchy_execution_changelist')
+                response = FileResponse(t)
+                extension = 'parquet'
+                content_type = 'application/vnd.apache.parquet'
+
+            response['Content-Disposition'] = f'attachment; filename={get_file_name(execution, "." + extension)}'
             response['Content-Type'] = content_type
 
             return response
@@ -201,12 +385,24 @@ class ExecutionAdmin(admin.ModelAdmin):
         return view
 
     def download_markup(self, obj):
-        return format_html(
+        if obj.is_queued:
+            return '-'  # no items yet
+        markup = format_html(
             '<a class="button" download href="{}">Excel</a>&nbsp;'
+            '<a class="button" download href="{}">CSV</a>&nbsp;'
+            '<a class="button" download href="{}">JSONL</a>&nbsp;'
             '<a class="button" download href="{}">SQLite</a>',
             reverse('admin:scratchy_execution_download_excel', args=[obj.pk]),
+            reverse('admin:scratchy_execution_download_csv', args=[obj.pk]),
+            reverse('admin:scratchy_execution_download_jsonl', args=[obj.pk]),
             reverse('admin:scratchy_execution_download_sqlite', args=[obj.pk]),
         )
+        if importlib.util.find_spec('pyarrow') is not None:  # optional dependency
+            markup += format_html(
+                '&nbsp;<a class="button" download href="{}">Parquet</a>',
+                reverse('admin:scratchy_execution_download_parquet', args=[obj.pk]),
+            )
+        return markup
 
     download_markup.short_description = 'Download Items'
     download_markup.allow_tags = True
@@ -241,6 +437,76 @@ def get_queryset(self, request):
     return super().get_queryset(request).select_related('spider')
 
 
+class CrawlRequestAdmin(admin.ModelAdmin):
+
+    def failed(self, obj):
+        return bool(obj.error)
+
+    failed.boolean = True
+
+    list_display = [
+        'spider',
+        'time_created',
+        'time_claimed',
+        'execution',
+        'failed',
+    ]
+
+    list_filter = [
+        'spider',
+    ]
+
+    raw_id_fields = [
+        'execution',
+    ]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('spider', 'execution')
+
+
+class SeenRequestAdmin(admin.ModelAdmin):
+    list_display = [
+        'url',
+        'spider',
+        'time_seen',
+    ]
+
+    list_filter = [
+        'spider',
+    ]
+
+    search_fields = [
+        'url',
+    ]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('spider')
+
+
+class CachedResponseAdmin(admin.ModelAdmin):
+    list_display = [
+        'url',
+        'spider',
+        'status',
+        'size',
+        'time_stored',
+    ]
+
+    list_filter = [
+        'spider',
+    ]
+
+    search_fields = [
+        'url',
+    ]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('spider').defer('body')
+
+
 admin.site.register(Spider, SpiderAdmin)
 admin.site.register(Execution, ExecutionAdmin)
 admin.site.register(Item, ItemAdmin)
+admin.site.register(CrawlRequest, CrawlRequestAdmin)
+admin.site.register(SeenRequest, SeenRequestAdmin)
+admin.site.register(CachedResponse, CachedResponseAdmin)
@@ -0,0 +1,299 @@
+import csv
+import json
+import sqlite3
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Avg, Count, Max
+
+from .models import Item, ExecutionSample
+
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """
+    File-like object that returns what is written, for streaming csv.writer output.
+    """
+
+    def write(self, value):
+        return value
+
+
+def get_item_keys(execution):
+    """
+    Returns the sorted top-level keys used by the items of an execution, computed by the database.
+    """
+    sql = (
+        f'SELECT DISTINCT jsonb_object_keys(data) AS key FROM {Item._meta.db_table} '
+        f'WHERE execution_id = %s AND jsonb_typeof(data) = %s ORDER BY key'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [execution.pk, 'object'])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def get_column_names(keys):
+    """
+    Returns the column names for the item keys followed by time_created, made unique
+    ignoring case (as SQLite does) by adding a number to keys that collide.
+    """
+    seen = {'time_created'}
+    names = []
+    for key in keys:
+        name, n = key, 1
+        while name.lower() in seen:
+            n += 1
+            name = f'{key}_{n}'
+        seen.add(name.lower())
+        names.append(name)
+    return names + ['time_created']
+
+
+def iter_items(execution, chunk_size=CHUNK_SIZE):
+    """
+    Yields (data, time_created) for every item of an execution using a server-side cursor.
+    """
+    qs = Item.objects.filter(execution=execution).order_by('id').values_list('data', 'time_created')
+    return qs.iterator(chunk_size=chunk_size)
+
+
+def flatten_value(value):
+    """
+    Nested values are stored as JSON text in flat formats.
+    """
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    return value
+
+
+def iter_rows(execution, keys):
+    for data, time_created in iter_items(execution):
+        yield [flatten_value(data.get(k)) for k in keys] + [time_created.isoformat()]
+
+
+def iter_csv(execution):
+    keys = get_item_keys(execution)
+    writer = csv.writer(Echo())
+    yield writer.writerow(get_column_names(keys))
+    for row in iter_rows(execution, keys):
+        yield writer.writerow(row)
+
+
+SAMPLE_FIELDS = [
+    'time',
+    'elapsed_seconds',
+    'requests',
+    'responses',
+    'items',
+    'response_bytes',
+    'requests_per_second',
+    'items_per_second',
+    'latency_p50',
+    'latency_p95',
+    'download_delay',
+    'active_requests',
+]
+
+
+def iter_samples_csv(execution):
+    writer = csv.writer(Echo())
+    yield writer.writerow(SAMPLE_FIELDS)
+    for row in ExecutionSample.objects.filter(execution=execution).order_by('time').values_list(*SAMPLE_FIELDS):
+        yield writer.writerow(row)
+
+
+def iter_spider_samples_csv(spider):
+    """
+    One row per execution of the spider with its samples aggregated, to compare
+    the throughput of executions over time.
+    """
+    fields = ['id', 'time_started', 'time_ended', 'item_count', 'samples',
+              'avg_requests_per_second', 'max_requests_per_second', 'avg_items_per_second',
+              'avg_latency_p50', 'max_latency_p95', 'avg_download_delay', 'max_active_requests']
+    executions = (
+        spider.execution_set
+        .annotate(
+            samples=Count('executionsample'),
+            avg_requests_per_second=Avg('executionsample__requests_per_second'),
+            max_requests_per_second=Max('executionsample__requests_per_second'),
+            avg_items_per_second=Avg('executionsample__items_per_second'),
+            avg_latency_p50=Avg('executionsample__latency_p50'),
+            max_latency_p95=Max('executionsample__latency_p95'),
+            avg_download_delay=Avg('executionsample__download_delay'),
+            max_active_requests=Max('executionsample__active_requests'),
+        )
+        .order_by('time_started')
+        .values_list(*fields)
+    )
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in executions:
+        yield writer.writerow(row)
+
+
+def iter_jsonl(execution):
+    encoder = DjangoJSONEncoder()
+    for data, time_created in iter_items(execution):
+        yield encoder.encode({**data, 'time_created': time_created}) + '\n'
+
+
+def write_xlsx(execution, file):
+    """
+    Writes the items of an execution to an xlsx file in constant memory.
+    """
+    from openpyxl import Workbook
+
+    keys = get_item_keys(execution)
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(get_column_names(keys))
+    for row in iter_rows(execution, keys):
+        sheet.append(row)
+    workbook.save(file)
+
+
+def quote_sqlite_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def write_sqlite(execution, path, batch_size=CHUNK_SIZE):
+    """
+    Writes the items of an execution to the items table of a SQLite database file.
+
+    Nested lists and dicts are stored as JSON text, usable with SQLite's JSON functions.
+    """
+    keys = get_item_keys(execution)
+    columns = ', '.join(quote_sqlite_identifier(name) for name in get_column_names(keys))
+    placeholders = ', '.join('?' for _ in range(len(keys) + 1))
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(f'CREATE TABLE items ({columns})')
+        rows = iter_rows(execution, keys)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            conn.executemany(f'INSERT INTO items ({columns}) VALUES ({placeholders})', batch)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_item_types(execution):
+    """
+    Returns {key: set of JSON types} for the top-level keys of the items of an execution.
+
+    Numbers are reported as 'integer' when every value of the key is integral and
+    fits in 64 bits.
+    """
+    sql = (
+        f'SELECT e.key, array_agg(DISTINCT jsonb_typeof(e.value)), '
+        f"bool_and(CASE WHEN jsonb_typeof(e.value) = 'number' THEN e.value::text ~ '^-?[0-9]+$' "
+        f'AND e.value::text::numeric BETWEEN -9223372036854775808 AND 9223372036854775807 ELSE true END) '
+        f'FROM {Item._meta.db_table} i, jsonb_each(i.data) e '
+        f'WHERE i.execution_id = %s AND jsonb_typeof(i.data) = %s GROUP BY e.key ORDER BY e.key'
+    )
+    types = {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [execution.pk, 'object'])
+        for key, json_types, integral in cursor.fetchall():
+            json_types = set(json_types)
+            if integral and 'number' in json_types:
+                json_types = (json_types - {'number'}) | {'integer'}
+            types[key] = json_types
+    return types
+
+
+def get_arrow_schema(execution):
+    """
+    Infers an Arrow schema for the items of an execution, widening types where keys
+    hold values of different types: integers and floats (and integers too large for
+    int64) become float64, any other mix becomes a string. Nested lists and dicts are stored as JSON strings.
+
+    Fields are named as get_column_names does, with the item key in their metadata.
+    """
+    import pyarrow as pa
+
+    arrow_types = {
+        'integer': pa.int64(),
+        'number': pa.float64(),
+        'boolean': pa.bool_(),
+        'string': pa.string(),
+        'array': pa.string(),
+        'object': pa.string(),
+    }
+
+    item_types = get_item_types(execution)
+    fields = []
+    for (key, json_types), name in zip(item_types.items(), get_column_names(list(item_types))):
+        json_types = json_types - {'null'}
+        if not json_types:
+            arrow_type = pa.null()
+        elif len(json_types) == 1:
+            arrow_type = arrow_types[json_types.pop()]
+        elif json_types == {'integer', 'number'}:
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type, metadata={'key': key}))
+
+    fields.append(pa.field('time_created', pa.timestamp('us', tz='UTC')))
+    return pa.schema(fields)
+
+
+def to_arrow_value(value, arrow_type):
+    import pyarrow as pa
+
+    if value is None:
+        return None
+    if arrow_type == pa.string() and not isinstance(value, str):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    if arrow_type == pa.float64():
+        return float(value)
+    return value
+
+
+def iter_record_batches(execution, schema=None, batch_size=CHUNK_SIZE):
+    """
+    Yields Arrow record batches of the items of an execution.
+    """
+    import pyarrow as pa
+
+    if schema is None:
+        schema = get_arrow_schema(execution)
+
+    keys = [field.metadata[b'key'].decode() for field in list(schema)[:-1]]  # time_created is last
+    rows = iter_items(execution, chunk_size=batch_size)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        arrays = [
+            pa.array([to_arrow_value(data.get(key), field.type) for data, _ in batch], type=field.type)
+            for key, field in zip(keys, schema)
+        ]
+        arrays.append(pa.array([time_created for _, time_created in batch], type=schema.field('time_created').type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def items_as_arrow(execution):
+    import pyarrow as pa
+
+    schema = get_arrow_schema(execution)
+    return pa.Table.from_batches(list(iter_record_batches(execution, schema)), schema=schema)
+
+
+def write_parquet(execution, path, compression='zstd'):
+    """
+    Writes the items of an execution to a Parquet file one record batch at a time.
+    """
+    import pyarrow.parquet as pq
+
+    schema = get_arrow_schema(execution)
+    with pq.ParquetWriter(path, schema, compression=compression) as writer:
+        for batch in iter_record_batches(execution, schema):
+            writer.write_batch(batch)
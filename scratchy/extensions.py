@@ -0,0 +1,159 @@
+import time
+
+from django.utils.timezone import now
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from .models import Execution, ExecutionSample
+
+
+def percentile(values, p):
+    """
+    Percentile of a sorted list, without interpolation.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class ExecutionProgress:
+    """
+    Saves a snapshot of the crawler stats and a heartbeat to the execution every
+    SCRATCHY_HEARTBEAT_INTERVAL seconds while the spider is open.
+
+    The snapshot adds the request, response and item rates over the last interval,
+    the heartbeat lets the watchdog tell running executions from dead ones. Set the
+    interval to 0 to disable both.
+    """
+
+    rates = {
+        'scratchy/requests_per_second': 'downloader/request_count',
+        'scratchy/responses_per_second': 'response_received_count',
+        'scratchy/items_per_second': 'item_scraped_count',
+    }
+
+    def __init__(self, stats, execution_id, interval=30.0):
+        self.stats = stats
+        self.execution_id = execution_id
+        self.interval = interval
+        self.loop = None
+        self.previous = {}
+        self.previous_time = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        interval = crawler.settings.getfloat('SCRATCHY_HEARTBEAT_INTERVAL', 30.0)
+        if interval <= 0:
+            raise NotConfigured
+        extension = cls(
+            stats=crawler.stats,
+            execution_id=crawler.settings.getint('SCRATCHY_EXECUTION_ID'),
+            interval=interval,
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.previous_time = time.monotonic()
+        self.loop = task.LoopingCall(self.beat)
+        self.loop.start(self.interval)
+
+    def spider_closed(self, spider):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+
+    def snapshot(self):
+        stats = dict(self.stats.get_stats())
+        t = time.monotonic()
+        elapsed = t - self.previous_time
+        for rate, key in self.rates.items():
+            value = stats.get(key, 0)
+            stats[rate] = round((value - self.previous.get(key, 0)) / elapsed, 2) if elapsed > 0 else 0
+            self.previous[key] = value
+        self.previous_time = t
+        return stats
+
+    def beat(self):
+        Execution.objects.filter(pk=self.execution_id, time_ended__isnull=True).update(
+            stats=self.snapshot(),
+            time_heartbeat=now(),
+        )
+
+
+class ExecutionSampler:
+    """
+    Records an ExecutionSample every SCRATCHY_SAMPLE_INTERVAL seconds, set it to 0 to disable.
+    """
+
+    def __init__(self, crawler, execution_id, interval=10.0):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.execution_id = execution_id
+        self.interval = interval
+        self.loop = None
+        self.latencies = []
+        self.started = None
+        self.previous = {}
+        self.previous_time = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        interval = crawler.settings.getfloat('SCRATCHY_SAMPLE_INTERVAL', 10.0)
+        if interval <= 0:
+            raise NotConfigured
+        extension = cls(crawler, execution_id=crawler.settings.getint('SCRATCHY_EXECUTION_ID'), interval=interval)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        return extension
+
+    def spider_opened(self, spider):
+        self.started = self.previous_time = time.monotonic()
+        self.loop = task.LoopingCall(self.sample)
+        self.loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.sample()
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def download_delay(self):
+        slots = getattr(getattr(self.crawler.engine, 'downloader', None), 'slots', {})
+        delays = [slot.delay for slot in slots.values()]
+        return sum(delays) / len(delays) if delays else None
+
+    def active_requests(self):
+        return len(getattr(getattr(self.crawler.engine, 'downloader', None), 'active', ()))
+
+    def sample(self):
+        t = time.monotonic()
+        elapsed = t - self.previous_time
+        requests = self.stats.get_value('downloader/request_count', 0)
+        items = self.stats.get_value('item_scraped_count', 0)
+        latencies, self.latencies = sorted(self.latencies), []
+
+        ExecutionSample.objects.create(
+            execution_id=self.execution_id,
+            time=now(),
+            elapsed_seconds=round(t - self.started, 2),
+            requests=requests,
+            responses=self.stats.get_value('response_received_count', 0),
+            items=items,
+            response_bytes=self.stats.get_value('downloader/response_bytes', 0),
+            requests_per_second=round((requests - self.previous.get('requests', 0)) / elapsed, 2) if elapsed > 0 else 0,
+            items_per_second=round((items - self.previous.get('items', 0)) / elapsed, 2) if elapsed > 0 else 0,
+            latency_p50=percentile(latencies, 50),
+            latency_p95=percentile(latencies, 95),
+            download_delay=self.download_delay(),
+            active_requests=self.active_requests(),
+        )
+
+        self.previous = {'requests': requests, 'items': items}
+        self.previous_time = t
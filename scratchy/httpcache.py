@@ -0,0 +1,79 @@
+import gzip
+from datetime import timedelta
+
+from django.utils.timezone import now
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+from .middlewares import get_fingerprinter
+from .models import CachedResponse
+
+
+class DatabaseCacheStorage:
+    """
+    Scrapy HTTP cache storage that keeps gzip compressed responses in the database,
+    so the cache is shared by all workers regardless of the host they run on.
+
+    Enable with HTTPCACHE_ENABLED and HTTPCACHE_STORAGE = 'scratchy.httpcache.DatabaseCacheStorage'.
+    Works with both cache policies (HTTPCACHE_POLICY). Responses older than
+    HTTPCACHE_EXPIRATION_SECS are ignored and deleted when the spider closes, after
+    which the oldest responses are evicted until the cache of the spider is smaller
+    than SCRATCHY_HTTPCACHE_MAX_BYTES.
+    """
+
+    def __init__(self, settings):
+        self.spider_id = settings.getint('SCRATCHY_SPIDER_ID')
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.max_bytes = settings.getint('SCRATCHY_HTTPCACHE_MAX_BYTES', 0)
+        self.fingerprint = None
+
+    def open_spider(self, spider):
+        self.fingerprint = get_fingerprinter(spider.crawler)
+
+    def close_spider(self, spider):
+        cached = CachedResponse.objects.filter(spider_id=self.spider_id)
+        if self.expiration_secs > 0:
+            cached.filter(time_stored__lt=now() - timedelta(seconds=self.expiration_secs)).delete()
+        if self.max_bytes > 0:
+            self.evict(cached)
+
+    def evict(self, cached):
+        total = 0
+        evict = []
+        for pk, size in cached.order_by('-time_stored').values_list('id', 'size').iterator():
+            total += size
+            if total > self.max_bytes:
+                evict.append(pk)
+        for i in range(0, len(evict), 1000):
+            CachedResponse.objects.filter(id__in=evict[i:i + 1000]).delete()
+
+    def retrieve_response(self, spider, request):
+        cached = CachedResponse.objects.filter(spider_id=self.spider_id, fingerprint=self.fingerprint(request)).first()
+        if cached is None:
+            return None
+        if 0 < self.expiration_secs and cached.time_stored < now() - timedelta(seconds=self.expiration_secs):
+            return None
+
+        headers = Headers({k.encode('latin-1'): [v.encode('latin-1') for v in values] for k, values in cached.headers.items()})
+        body = gzip.decompress(cached.body)
+        respcls = responsetypes.from_args(headers=headers, url=cached.url, body=body)
+        return respcls(url=cached.url, headers=headers, status=cached.status, body=body)
+
+    def store_response(self, spider, request, response):
+        body = gzip.compress(response.body)
+        headers = {
+            k.decode('latin-1'): [v.decode('latin-1') for v in values]
+            for k, values in response.headers.items()
+        }
+        CachedResponse.objects.update_or_create(
+            spider_id=self.spider_id,
+            fingerprint=self.fingerprint(request),
+            defaults=dict(
+                url=response.url,
+                status=response.status,
+                headers=headers,
+                body=body,
+                size=len(body),
+                time_stored=now(),
+            ),
+        )
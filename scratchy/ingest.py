@@ -0,0 +1,184 @@
+import csv
+import hashlib
+import json
+from io import StringIO
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from .models import Execution, Item
+from .purge import Purge
+
+BULK_CREATE = 'bulk_create'
+COPY = 'copy'
+
+METHODS = (BULK_CREATE, COPY)
+
+DEDUP_SKIP = 'skip'
+DEDUP_UPDATE = 'update'
+
+DEDUP_MODES = (DEDUP_SKIP, DEDUP_UPDATE)
+
+COPY_FIELDS = (
+    'time_created',
+    'spider',
+    'execution',
+    'data',
+    'processed',
+)
+
+
+def get_method(method):
+    """
+    Returns the ingest method to use on the current database, falling back to
+    bulk_create when COPY is requested on a backend other than PostgreSQL.
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unknown item ingest method "{method}", expected one of {", ".join(METHODS)}')
+    if method == COPY and connection.vendor != 'postgresql':
+        return BULK_CREATE
+    return method
+
+
+def check_dedup(dedup):
+    """
+    Returns the dedup mode, raises ValueError for unknown modes.
+    """
+    if dedup is not None and dedup not in DEDUP_MODES:
+        raise ValueError(f'Unknown item dedup mode "{dedup}", expected one of {", ".join(DEDUP_MODES)}')
+    return dedup
+
+
+class ItemJSONEncoder(DjangoJSONEncoder):
+    """
+    Also encodes sets and frozensets, as Scrapy's JSON feed exporter does.
+    """
+
+    def default(self, o):
+        if isinstance(o, (set, frozenset)):
+            return list(o)
+        return super().default(o)
+
+
+def to_json_data(data):
+    """
+    Returns the item data as plain JSON values, raises TypeError or ValueError for
+    values that can't be encoded.
+    """
+    return json.loads(json.dumps(data, cls=ItemJSONEncoder))
+
+
+def canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder)
+
+
+def get_data_hash(data, fields=None):
+    """
+    Returns a stable hash of the item data, or of only the given fields of it.
+    """
+    if fields:
+        data = {f: data.get(f) for f in fields}
+    return hashlib.sha256(canonical_json(data).encode('utf-8')).hexdigest()
+
+
+def save_items(items, method=BULK_CREATE, dedup=None):
+    """
+    Saves a list of unsaved Item instances, returns the number of new, updated and
+    unchanged items.
+
+    With dedup, items must have data_hash set and belong to the same spider, see save_unique_items.
+    """
+    counts = {'new': 0, 'updated': 0, 'unchanged': 0}
+    if not items:
+        return counts
+    if check_dedup(dedup) is not None:
+        return save_unique_items(items, update=dedup == DEDUP_UPDATE)
+    method = get_method(method)
+    if method == COPY:
+        copy_items(items)
+    else:
+        Item.objects.bulk_create(items)
+    counts['new'] = len(items)
+    return counts
+
+
+def save_unique_items(items, update=False):
+    """
+    Saves only items whose data_hash has not been seen for the spider before.
+
+    With update, previously seen items whose data changed (possible when hashing
+    only some fields) are updated in place, moved to the new execution and marked
+    as unprocessed; the item_count of the executions they are moved from is
+    decremented. Items are always inserted with bulk_create, ignoring conflicts
+    with items inserted concurrently, which are counted as unchanged.
+    """
+    by_hash = {}
+    for item in items:
+        by_hash[item.data_hash] = item  # the last duplicate within a batch wins
+
+    existing = Item.objects.filter(spider_id=items[0].spider_id, data_hash__in=list(by_hash))
+    if update:
+        existing = {h: (pk, data) for h, pk, data in existing.values_list('data_hash', 'id', 'data')}
+    else:
+        existing = {h: None for h in existing.values_list('data_hash', flat=True)}
+
+    new = [item for h, item in by_hash.items() if h not in existing]
+    Item.objects.bulk_create(new, ignore_conflicts=True)
+    # primary keys aren't set with ignore_conflicts, look up which rows are ours
+    inserted = sum(
+        1 for h, execution_id in Item.objects.filter(
+            spider_id=items[0].spider_id,
+            data_hash__in=[item.data_hash for item in new],
+        ).values_list('data_hash', 'execution_id')
+        if execution_id == by_hash[h].execution_id
+    ) if new else 0
+
+    changed = []
+    if update:
+        for h, (pk, data) in existing.items():
+            item = by_hash[h]
+            if canonical_json(data) != canonical_json(item.data):
+                changed.append(Item(id=pk, data=item.data, execution_id=item.execution_id, processed=False))
+        with transaction.atomic():
+            # the caller adds the moved items to the count of their new execution
+            Purge.decrement_counts(
+                Item.objects.filter(id__in=[item.id for item in changed]), 'execution', Execution, 'item_count',
+            )
+            Item.objects.bulk_update(changed, ['data', 'execution', 'processed'])
+
+    return {
+        'new': inserted,
+        'updated': len(changed),
+        'unchanged': len(items) - inserted - len(changed),
+    }
+
+
+def copy_items(items):
+    """
+    Streams items into the item table with COPY ... FROM STDIN using CSV format.
+
+    Unlike bulk_create, primary keys are not set on the instances afterwards.
+    """
+    timestamp = now()
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    encoder = DjangoJSONEncoder()
+
+    for item in items:
+        writer.writerow([
+            (item.time_created or timestamp).isoformat(),
+            item.spider_id,
+            '' if item.execution_id is None else item.execution_id,  # unquoted empty value is NULL
+            encoder.encode(item.data),
+            't' if item.processed else 'f',
+        ])
+
+    buffer.seek(0)
+
+    columns = ', '.join(connection.ops.quote_name(Item._meta.get_field(f).column) for f in COPY_FIELDS)
+    table = connection.ops.quote_name(Item._meta.db_table)
+    sql = f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)'
+
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, buffer)
@@ -0,0 +1,74 @@
+import logging
+import time
+from collections import deque
+
+from .models import Execution, compress
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutionLogHandler(logging.Handler):
+    """
+    Captures the log of an execution and saves it to the execution while the crawl runs.
+
+    Memory is bounded by keeping only the first head_lines and the last tail_lines
+    records, records in between are counted and replaced by a marker. The log is
+    saved when a record is emitted at least flush_interval seconds after the
+    previous save, and once more when the handler is closed.
+    """
+
+    def __init__(self, execution_id, head_lines=5000, tail_lines=5000, flush_interval=10.0, level=logging.NOTSET):
+        super().__init__(level)
+        self.execution_id = execution_id
+        self.head_lines = head_lines
+        self.head = []
+        self.tail = deque(maxlen=tail_lines)
+        self.omitted = 0
+        self.flush_interval = flush_interval
+        self.last_save = time.monotonic()
+        self.dirty = False
+        self.saving = False
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        if len(self.head) < self.head_lines:
+            self.head.append(msg)
+        else:
+            if len(self.tail) == self.tail.maxlen:
+                self.omitted += 1
+            self.tail.append(msg)
+
+        self.dirty = True
+
+        if self.flush_interval and time.monotonic() - self.last_save >= self.flush_interval:
+            self.save()
+
+    def getvalue(self):
+        lines = list(self.head)
+        if self.omitted:
+            lines.append(f'[... {self.omitted} log records omitted ...]')
+        lines.extend(self.tail)
+        return ''.join(f'{line}\n' for line in lines)
+
+    def save(self):
+        if self.saving or not self.dirty:
+            return
+
+        self.saving = True  # saving may log (e.g. database debug output), don't recurse
+        try:
+            Execution.objects.filter(pk=self.execution_id).update(log_data=compress(self.getvalue()))
+            self.dirty = False
+        except Exception:
+            logger.exception(f'Could not save log of execution {self.execution_id}')
+        finally:
+            self.last_save = time.monotonic()
+            self.saving = False
+
+    def close(self):
+        self.save()
+        super().close()
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import now
+
+from scratchy.ingest import METHODS, get_method, save_items
+from scratchy.models import Spider, Execution, Item
+
+
+def make_item(spider_id, execution_id, n):
+    return Item(
+        spider_id=spider_id,
+        execution_id=execution_id,
+        data={
+            'title': f'Item {n}',
+            'content': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 4,
+            'price': n * 1.5,
+            'tags': ['a', 'b', 'c'],
+            'scraped': now(),
+        },
+    )
+
+
+class Command(BaseCommand):
+    help = 'Compare item ingest throughput (rows/sec) of the available ingest methods. All rows are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counts', type=int, nargs='+', default=[10000, 100000, 1000000])
+        parser.add_argument('--methods', nargs='+', choices=METHODS, default=list(METHODS))
+        parser.add_argument('--batch-size', type=int, default=100, help='Same as SCRATCHY_ITEM_BATCH_SIZE.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        for method in options['methods']:
+            if get_method(method) != method:
+                self.stderr.write(f'Skipping "{method}", not supported by this database')
+                continue
+
+            for count in options['counts']:
+                elapsed = self.run(method, count, batch_size)
+                self.stdout.write(f'{method:<12} {count:>9} rows {elapsed:8.2f}s {count / elapsed:12.0f} rows/sec')
+
+    def run(self, method, count, batch_size):
+        with transaction.atomic():
+            spider = Spider.objects.create(module=f'scratchy.benchmark.{method}.{count}')
+            execution = Execution.objects.create(spider=spider, time_started=now())
+
+            elapsed = 0.0
+            for start in range(0, count, batch_size):
+                items = [make_item(spider.id, execution.id, n) for n in range(start, min(start + batch_size, count))]
+                t = time.perf_counter()
+                save_items(items, method=method)
+                elapsed += time.perf_counter() - t
+
+            transaction.set_rollback(True)
+
+        return elapsed
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from scratchy.worker import CrawlWorker
+
+
+class Command(BaseCommand):
+    help = 'Run pending crawl requests in a long-lived crawler process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Maximum number of concurrent crawls.')
+        parser.add_argument('--per-spider', type=int, default=1, help='Maximum number of concurrent crawls of the same spider.')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between checks for new crawl requests.')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Starting crawl worker')
+        CrawlWorker(
+            concurrency=options['concurrency'],
+            per_spider=options['per_spider'],
+            poll_interval=options['poll_interval'],
+        ).run()
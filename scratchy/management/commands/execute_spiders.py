@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from scratchy.models import Spider
+from scratchy.tasks import run_spiders
+
+
+class Command(BaseCommand):
+    help = 'Run several spiders concurrently in a single crawler process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('spider_ids', type=int, nargs='*')
+        parser.add_argument('--active', action='store_true', help='Run all active spiders.')
+
+    def handle(self, *args, **options):
+        spider_ids = options['spider_ids']
+
+        if options['active']:
+            spider_ids += Spider.objects.filter(active=True).values_list('id', flat=True)
+
+        self.stdout.write(f'Running spiders with IDs {", ".join(str(i) for i in spider_ids)}')
+        run_spiders(spider_ids)
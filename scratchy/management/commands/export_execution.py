@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from scratchy import exports
+from scratchy.models import Execution
+
+
+class Command(BaseCommand):
+    help = 'Export the items of an execution to a file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('execution_id', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['excel', 'csv', 'jsonl', 'sqlite', 'parquet'], default='parquet')
+
+    def handle(self, *args, **options):
+        execution = Execution.objects.defer('log_data').get(id=options['execution_id'])
+        path = options['path']
+        format = options['format']
+
+        self.stdout.write(f'Exporting items of execution {execution.id} to {path}')
+
+        if format == 'excel':
+            exports.write_xlsx(execution, path)
+        elif format == 'sqlite':
+            exports.write_sqlite(execution, path)
+        elif format == 'parquet':
+            exports.write_parquet(execution, path)
+        else:
+            chunks = exports.iter_csv(execution) if format == 'csv' else exports.iter_jsonl(execution)
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.writelines(chunks)
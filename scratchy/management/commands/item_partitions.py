@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from scratchy import partitions
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming item partitions and remove expired ones, or convert the item table to a partitioned table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', help='Convert the item table to a partitioned table.')
+        parser.add_argument('--detach-only', action='store_true', help='Detach expired partitions without dropping them.')
+        parser.add_argument('--unprocessed', action='store_true', help='Also remove expired partitions holding unprocessed items.')
+
+    def handle(self, *args, **options):
+        interval = partitions.get_interval()
+        if interval is None:
+            raise CommandError('SCRATCHY_ITEM_PARTITION_INTERVAL is not set')
+
+        if options['convert']:
+            self.stdout.write(f'Converting item table to {interval} partitions')
+            partitions.convert(interval)
+
+        ahead = getattr(settings, 'SCRATCHY_ITEM_PARTITIONS_AHEAD', 3)
+        for name in partitions.create_partitions(interval, ahead=ahead):
+            self.stdout.write(f'Created partition {name}')
+
+        retention_days = getattr(settings, 'SCRATCHY_ITEM_RETENTION_DAYS', None)
+        if retention_days is not None:
+            unprocessed = options['unprocessed'] or getattr(settings, 'SCRATCHY_ITEM_RETENTION_UNPROCESSED', False)
+            removed = partitions.drop_expired_partitions(
+                retention_days, drop=not options['detach_only'], unprocessed=unprocessed,
+            )
+            for name in removed:
+                self.stdout.write(f'Removed partition {name}')
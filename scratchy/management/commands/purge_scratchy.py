@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from scratchy.models import Spider
+from scratchy.purge import Purge
+
+
+class Command(BaseCommand):
+    help = 'Delete processed items and old executions in batches according to the retention settings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('spider_ids', type=int, nargs='*', help='Limit to these spiders, default is all.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to wait between batches.')
+        parser.add_argument('--max-runtime', type=float, default=None, help='Stop after this many seconds.')
+        parser.add_argument('--delete-spider', action='store_true', help='Delete the given spiders with all their items and executions.')
+
+    def handle(self, *args, **options):
+        if options['delete_spider'] and not options['spider_ids']:
+            raise CommandError('--delete-spider requires the ids of the spiders to delete')
+
+        purge = Purge(
+            batch_size=options['batch_size'],
+            sleep=options['sleep'],
+            max_runtime=options['max_runtime'],
+            report=self.stdout.write,
+        )
+
+        spiders = Spider.objects.all()
+        if options['spider_ids']:
+            spiders = spiders.filter(id__in=options['spider_ids'])
+
+        if options['delete_spider']:
+            for spider in spiders:
+                purge.delete_spider(spider)
+        else:
+            purge.run(spiders)
@@ -0,0 +1,33 @@
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.core.management.base import BaseCommand
+from scratchy.models import Spider, Execution, Item
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the denormalized item and execution counters of spiders and executions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('spider_ids', type=int, nargs='*', help='Limit to these spiders, default is all.')
+
+    def handle(self, *args, **options):
+        spiders = Spider.objects.all()
+        if options['spider_ids']:
+            spiders = spiders.filter(id__in=options['spider_ids'])
+
+        item_counts = Item.objects.filter(execution=OuterRef('pk')).order_by().values('execution').annotate(n=Count('id')).values('n')
+
+        for spider in spiders:
+            self.stdout.write(f'Rebuilding counters of spider {spider}')
+
+            # one statement per spider keeps each update bounded
+            Execution.objects.filter(spider=spider).update(item_count=Coalesce(Subquery(item_counts), Value(0)))
+
+            # counted when they end, as Execution.update_spider_counters does
+            executions = Execution.objects.filter(spider=spider, time_ended__isnull=False)
+            last_execution = executions.order_by('-time_ended').only('id', 'stats').first()
+
+            spider.execution_count = executions.count()
+            spider.last_execution = last_execution
+            spider.last_finish_reason = last_execution.stats.get('finish_reason', '') if last_execution else ''
+            spider.save(update_fields=['execution_count', 'last_execution', 'last_finish_reason'])
@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from scratchy.models import Spider
-from scratchy.tasks import run_spider
+from scratchy.tasks import queue_spider
 
 
 class Command(BaseCommand):
@@ -8,4 +8,4 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         for spider in Spider.objects.filter(active=True):
             self.stdout.write(f'scheduling spider module {spider.module}')
-            run_spider.delay(spider.id)
+            queue_spider(spider.id)
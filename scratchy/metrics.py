@@ -0,0 +1,177 @@
+"""
+Prometheus metrics of crawls and item ingest, labeled per spider.
+
+Enabled with SCRATCHY_METRICS_ENABLED, requires prometheus_client
+(pip install django-scratchy[metrics]). Crawls run in other processes than the
+web server, so set the PROMETHEUS_MULTIPROC_DIR environment variable to a
+directory shared by the celery workers and the web server; the metrics view then
+aggregates the values written by all processes. Every process leaves its own
+files behind, compact_files merges those of processes that have exited.
+"""
+import glob
+import os
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+INGEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DURATION_BUCKETS = (10, 30, 60, 300, 600, 1800, 3600, 3 * 3600, 6 * 3600, 24 * 3600)
+
+
+class Metrics:
+
+    def __init__(self):
+        from prometheus_client import Counter, Histogram
+
+        self.requests = Counter('scratchy_requests', 'Requests sent to the downloader', ['spider'])
+        self.responses = Counter('scratchy_responses', 'Responses received', ['spider'])
+        self.response_bytes = Counter('scratchy_response_bytes', 'Bytes of response bodies received', ['spider'])
+        self.items = Counter('scratchy_items', 'Items scraped', ['spider'])
+        self.response_latency = Histogram(
+            'scratchy_response_latency_seconds', 'Download latency of responses', ['spider'], buckets=LATENCY_BUCKETS,
+        )
+        self.ingest_batch = Histogram(
+            'scratchy_ingest_batch_seconds', 'Time to save a batch of items', ['spider', 'method'], buckets=INGEST_BUCKETS,
+        )
+        self.queue_wait = Histogram(
+            'scratchy_queue_wait_seconds', 'Time from queueing a crawl until its execution starts', ['spider'],
+            buckets=DURATION_BUCKETS,
+        )
+        self.execution_duration = Histogram(
+            'scratchy_execution_duration_seconds', 'Duration of executions', ['spider', 'finish_reason'],
+            buckets=DURATION_BUCKETS,
+        )
+
+
+@lru_cache(maxsize=None)
+def get_metrics():
+    """
+    Returns the metrics, or None when they are disabled or prometheus_client is
+    not installed.
+    """
+    if not getattr(settings, 'SCRATCHY_METRICS_ENABLED', False):
+        return None
+    try:
+        return Metrics()
+    except ImportError:
+        return None
+
+
+def get_multiproc_dir():
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_values(path):
+    from prometheus_client.mmap_dict import MmapedDict
+
+    values = MmapedDict(path)
+    try:
+        # (key, value) or (key, value, timestamp) depending on the prometheus_client version
+        return [(key, value) for key, value, *_ in values.read_all_values()]
+    finally:
+        values.close()
+
+
+def write_values(path, totals):
+    from prometheus_client.mmap_dict import MmapedDict
+
+    values = MmapedDict(path)
+    try:
+        for key, value in totals.items():
+            try:
+                values.write_value(key, value, 0.0)  # prometheus_client >= 0.16 stores a timestamp
+            except TypeError:
+                values.write_value(key, value)
+    finally:
+        values.close()
+
+
+def compact_files(directory=None):
+    """
+    Merges the counter and histogram files of processes that are no longer running
+    into one archive file per type, so the directory doesn't grow with every celery
+    worker child. Returns the number of files merged.
+
+    Only processes on this host are recognised, run it where the directory is
+    local and never twice at the same time.
+    """
+    directory = directory or get_multiproc_dir()
+    if not directory:
+        return 0
+
+    merged = 0
+    for kind in ('counter', 'histogram'):  # both are sums, gauges are not used
+        archive = os.path.join(directory, f'{kind}_archive.db')
+        dead = []
+        for path in glob.glob(os.path.join(directory, f'{kind}_*.db')):
+            match = re.fullmatch(rf'{kind}_(\d+)\.db', os.path.basename(path))
+            if match and not is_running(int(match.group(1))):
+                dead.append(path)
+        if not dead:
+            continue
+
+        totals = defaultdict(float)
+        for path in ([archive] if os.path.exists(archive) else []) + dead:
+            for key, value in read_values(path):
+                totals[key] += value
+
+        # the metrics view reads the directory concurrently, replace the archive at once
+        temporary = f'{archive}.tmp'
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        write_values(temporary, totals)
+        os.replace(temporary, archive)
+        for path in dead:
+            os.remove(path)
+        merged += len(dead)
+
+    return merged
+
+
+class MetricsExtension:
+    """
+    Counts requests, responses, bytes and items and records the download latency
+    of each response.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        metrics = get_metrics()
+        if metrics is None:
+            raise NotConfigured
+        extension = cls(metrics)
+        crawler.signals.connect(extension.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        return extension
+
+    def request_reached_downloader(self, request, spider):
+        self.metrics.requests.labels(spider.name).inc()
+
+    def response_received(self, response, request, spider):
+        self.metrics.responses.labels(spider.name).inc()
+        self.metrics.response_bytes.labels(spider.name).inc(len(response.body))
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.metrics.response_latency.labels(spider.name).observe(latency)
+
+    def item_scraped(self, item, response, spider):
+        self.metrics.items.labels(spider.name).inc()
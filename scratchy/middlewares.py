@@ -0,0 +1,173 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils.timezone import now
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+
+from .models import SeenRequest
+
+
+def get_fingerprinter(crawler):
+    """
+    Returns a function computing the hex fingerprint of a request.
+    """
+    fingerprinter = getattr(crawler, 'request_fingerprinter', None)  # scrapy >= 2.7
+    if fingerprinter is not None:
+        return lambda request: fingerprinter.fingerprint(request).hex()
+
+    from scrapy.utils.request import request_fingerprint
+    return request_fingerprint
+
+
+class SeenRequestMiddleware:
+    """
+    Skips requests that were already fetched by earlier executions of the spider.
+
+    Enable with SCRATCHY_SEEN_ENABLED and list the callbacks of the requests to skip
+    in SCRATCHY_SEEN_CALLBACKS, typically those of detail pages; listing pages must
+    be fetched again to find new links. request.meta['scratchy_seen'] overrides this
+    for a single request, requests with dont_filter (such as start requests) are
+    otherwise never skipped. Seen requests expire after SCRATCHY_SEEN_TTL seconds,
+    with SCRATCHY_SEEN_REVALIDATE expired requests are sent as conditional requests
+    and dropped when the server replies 304 Not Modified.
+
+    Requests are recorded by SeenRequestSpiderMiddleware once their callback has
+    completed, so a failing callback does not mark a request as seen.
+
+    The fingerprints are loaded into memory when the spider opens, so requests are
+    not delayed by a query each; expiry is determined as of that time.
+    """
+    preload = True
+
+    def __init__(self, spider_id, fingerprint, ttl=None, callbacks=None, revalidate=False, stats=None, batch_size=100):
+        self.spider_id = spider_id
+        self.fingerprint = fingerprint
+        self.ttl = timedelta(seconds=ttl) if ttl else None
+        self.callbacks = set(callbacks or [])
+        self.revalidate = revalidate
+        self.stats = stats
+        self.batch_size = batch_size
+        self.buffer = {}
+        self.seen = set()  # fingerprints of requests to skip
+        self.validators = {}  # fingerprint: (etag, last_modified) of expired requests to revalidate
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('SCRATCHY_SEEN_ENABLED'):
+            raise NotConfigured
+        if not settings.getlist('SCRATCHY_SEEN_CALLBACKS'):
+            raise NotConfigured('SCRATCHY_SEEN_CALLBACKS must list the callbacks of the requests to skip')
+
+        middleware = cls(
+            spider_id=settings.getint('SCRATCHY_SPIDER_ID'),
+            fingerprint=get_fingerprinter(crawler),
+            ttl=settings.getfloat('SCRATCHY_SEEN_TTL', 0),
+            callbacks=settings.getlist('SCRATCHY_SEEN_CALLBACKS'),
+            revalidate=settings.getbool('SCRATCHY_SEEN_REVALIDATE'),
+            stats=crawler.stats,
+        )
+        if cls.preload:
+            crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        expires = now() - self.ttl if self.ttl is not None else None
+        seen = SeenRequest.objects.filter(spider_id=self.spider_id)
+        if expires is not None and not self.revalidate:
+            seen = seen.filter(time_seen__gt=expires)
+        for fingerprint, time_seen, etag, last_modified in seen.values_list(
+            'fingerprint', 'time_seen', 'etag', 'last_modified',
+        ).iterator(chunk_size=10000):
+            if expires is None or time_seen > expires:
+                self.seen.add(fingerprint)
+            elif etag or last_modified:
+                self.validators[fingerprint] = (etag, last_modified)
+
+    def applies(self, request):
+        if 'scratchy_seen' in request.meta:
+            return bool(request.meta['scratchy_seen'])
+        if request.dont_filter:
+            return False
+        return getattr(request.callback, '__name__', 'parse') in self.callbacks
+
+    def process_request(self, request, spider):
+        if not self.applies(request):
+            return None
+
+        fingerprint = self.fingerprint(request)
+        if fingerprint in self.seen:
+            self.stats.inc_value('scratchy/seen/skipped', spider=spider)
+            raise IgnoreRequest(f'Already seen {request.url}')
+
+        if self.revalidate and fingerprint in self.validators:
+            etag, last_modified = self.validators[fingerprint]
+            if etag:
+                request.headers.setdefault('If-None-Match', etag)
+            if last_modified:
+                request.headers.setdefault('If-Modified-Since', last_modified)
+            request.meta['scratchy_seen_revalidate'] = True
+
+        return None
+
+    def process_response(self, request, response, spider):
+        if not self.applies(request):
+            return response
+
+        if response.status == 304 and request.meta.get('scratchy_seen_revalidate'):
+            self.record(request, response)
+            self.stats.inc_value('scratchy/seen/not_modified', spider=spider)
+            raise IgnoreRequest(f'Not modified {request.url}')
+
+        return response
+
+    def record(self, request, response):
+        fingerprint = self.fingerprint(request)
+        self.buffer[fingerprint] = SeenRequest(
+            spider_id=self.spider_id,
+            fingerprint=fingerprint,
+            url=request.url,
+            time_seen=now(),
+            # a 304 may omit the validators, keep the ones that were sent
+            etag=(response.headers.get('ETag') or request.headers.get('If-None-Match') or b'').decode('latin-1'),
+            last_modified=(response.headers.get('Last-Modified') or request.headers.get('If-Modified-Since') or b'').decode('latin-1'),
+        )
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        seen, self.buffer = self.buffer, {}
+        with transaction.atomic():
+            # replace expired entries
+            SeenRequest.objects.filter(spider_id=self.spider_id, fingerprint__in=list(seen)).delete()
+            SeenRequest.objects.bulk_create(list(seen.values()), ignore_conflicts=True)
+
+    def spider_closed(self, spider):
+        self.flush()
+
+
+class SeenRequestSpiderMiddleware(SeenRequestMiddleware):
+    """
+    Records the requests of SeenRequestMiddleware after their callback has
+    processed the response without raising.
+    """
+    preload = False
+
+    def process_spider_output(self, response, result, spider):
+        yield from result
+        self.record_response(response)
+
+    async def process_spider_output_async(self, response, result, spider):
+        # async callbacks, scrapy >= 2.7
+        async for output in result:
+            yield output
+        self.record_response(response)
+
+    def record_response(self, response):
+        request = response.request
+        if request is not None and 200 <= response.status < 300 and self.applies(request):
+            self.record(request, response)
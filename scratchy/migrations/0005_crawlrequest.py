@@ -0,0 +1,24 @@
+# Generated by Django 3.0.4 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0004_auto_20200412_0950'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('time_claimed', models.DateTimeField(blank=True, null=True)),
+                ('execution', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='scratchy.Execution')),
+                ('spider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scratchy.Spider')),
+            ],
+        ),
+    ]
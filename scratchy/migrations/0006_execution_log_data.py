@@ -0,0 +1,39 @@
+# Generated by Django 3.0.4 on 2026-10-18 09:40
+
+import gzip
+
+from django.db import migrations, models
+
+
+def compress_logs(apps, schema_editor):
+    Execution = apps.get_model('scratchy', 'Execution')
+    for execution in Execution.objects.exclude(log='').only('id', 'log').iterator():
+        log_data = gzip.compress(execution.log.encode('utf-8'))
+        Execution.objects.filter(pk=execution.pk).update(log_data=log_data)
+
+
+def decompress_logs(apps, schema_editor):
+    Execution = apps.get_model('scratchy', 'Execution')
+    for execution in Execution.objects.exclude(log_data=b'').only('id', 'log_data').iterator():
+        log = gzip.decompress(execution.log_data).decode('utf-8')
+        Execution.objects.filter(pk=execution.pk).update(log=log)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0005_crawlrequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='execution',
+            name='log_data',
+            field=models.BinaryField(blank=True, default=b'', help_text='Gzip compressed log.'),
+        ),
+        migrations.RunPython(compress_logs, decompress_logs),
+        migrations.RemoveField(
+            model_name='execution',
+            name='log',
+        ),
+    ]
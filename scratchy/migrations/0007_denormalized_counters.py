@@ -0,0 +1,59 @@
+# Generated by Django 3.0.4 on 2026-10-18 10:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_counters(apps, schema_editor):
+    """
+    Same as the rebuild_scratchy_counters command.
+    """
+    Spider = apps.get_model('scratchy', 'Spider')
+    Execution = apps.get_model('scratchy', 'Execution')
+    Item = apps.get_model('scratchy', 'Item')
+    db = schema_editor.connection.alias
+
+    item_counts = Item.objects.using(db).filter(execution=OuterRef('pk')).order_by().values('execution').annotate(n=Count('id')).values('n')
+    for spider in Spider.objects.using(db).all():
+        Execution.objects.using(db).filter(spider=spider).update(item_count=Coalesce(Subquery(item_counts), Value(0)))
+
+        executions = Execution.objects.using(db).filter(spider=spider, time_ended__isnull=False)
+        last_execution = executions.order_by('-time_ended').only('id', 'stats').first()
+
+        spider.execution_count = executions.count()
+        spider.last_execution = last_execution
+        spider.last_finish_reason = last_execution.stats.get('finish_reason', '') if last_execution else ''
+        spider.save(update_fields=['execution_count', 'last_execution', 'last_finish_reason'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0006_execution_log_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='execution',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='spider',
+            name='execution_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='spider',
+            name='last_execution',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='scratchy.Execution'),
+        ),
+        migrations.AddField(
+            model_name='spider',
+            name='last_finish_reason',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.4 on 2026-10-18 10:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0007_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(processed=False), fields=['spider', 'id'], name='scratchy_item_unprocessed'),
+        ),
+    ]
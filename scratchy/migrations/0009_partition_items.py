@@ -0,0 +1,30 @@
+# Generated by Django 3.0.4 on 2026-10-18 11:02
+
+from django.db import migrations
+
+from scratchy import partitions
+
+
+def partition_items(apps, schema_editor):
+    interval = partitions.get_interval()
+    if interval is not None and schema_editor.connection.vendor == 'postgresql':
+        partitions.convert(interval, using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+    """
+    Only converts the item table when SCRATCHY_ITEM_PARTITION_INTERVAL is set,
+    otherwise run the item_partitions command with --convert later.
+
+    Not atomic, so the conversion can build its index concurrently.
+    """
+
+    atomic = False
+
+    dependencies = [
+        ('scratchy', '0008_item_claimed_until'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_items, migrations.RunPython.noop),
+    ]
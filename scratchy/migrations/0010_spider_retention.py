@@ -0,0 +1,23 @@
+# Generated by Django 3.0.4 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0009_partition_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spider',
+            name='execution_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Delete executions older than this. Defaults to SCRATCHY_EXECUTION_RETENTION_DAYS.', null=True),
+        ),
+        migrations.AddField(
+            model_name='spider',
+            name='item_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Delete processed items older than this. Defaults to SCRATCHY_PROCESSED_ITEM_RETENTION_DAYS.', null=True),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.0.4 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+from scratchy import partitions
+
+
+def add_hash_constraint(apps, schema_editor):
+    """
+    Unique constraints must include the partition key on partitioned tables,
+    so use a plain index there. Deduplication then relies on the lookup done
+    before inserting.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        partitioned = schema_editor.connection.vendor == 'postgresql' and partitions.is_partitioned(cursor)
+    if partitioned:
+        schema_editor.execute('CREATE INDEX scratchy_item_unique_hash ON scratchy_item (spider_id, data_hash)')
+    else:
+        schema_editor.execute('ALTER TABLE scratchy_item ADD CONSTRAINT scratchy_item_unique_hash UNIQUE (spider_id, data_hash)')
+
+
+def remove_hash_constraint(apps, schema_editor):
+    schema_editor.execute('ALTER TABLE scratchy_item DROP CONSTRAINT IF EXISTS scratchy_item_unique_hash')
+    schema_editor.execute('DROP INDEX IF EXISTS scratchy_item_unique_hash')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0010_spider_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='data_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='item',
+                    constraint=models.UniqueConstraint(fields=('spider', 'data_hash'), name='scratchy_item_unique_hash'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(add_hash_constraint, remove_hash_constraint),
+            ],
+        ),
+    ]
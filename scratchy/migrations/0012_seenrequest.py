@@ -0,0 +1,30 @@
+# Generated by Django 3.0.4 on 2026-10-18 12:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0011_item_data_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeenRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('url', models.TextField()),
+                ('time_seen', models.DateTimeField()),
+                ('etag', models.CharField(blank=True, max_length=200)),
+                ('last_modified', models.CharField(blank=True, max_length=200)),
+                ('spider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scratchy.Spider')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='seenrequest',
+            constraint=models.UniqueConstraint(fields=('spider', 'fingerprint'), name='scratchy_seenrequest_unique_fingerprint'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.4 on 2026-10-18 13:15
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0012_seenrequest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedResponse',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('url', models.TextField()),
+                ('status', models.PositiveSmallIntegerField()),
+                ('headers', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict)),
+                ('body', models.BinaryField(help_text='Gzip compressed body.')),
+                ('size', models.PositiveIntegerField(help_text='Size of the compressed body in bytes.')),
+                ('time_stored', models.DateTimeField(db_index=True)),
+                ('spider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scratchy.Spider')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='cachedresponse',
+            constraint=models.UniqueConstraint(fields=('spider', 'fingerprint'), name='scratchy_cachedresponse_unique_fingerprint'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.4 on 2026-10-18 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0013_cachedresponse'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spider',
+            name='domain',
+            field=models.CharField(blank=True, help_text='Used to limit concurrent executions per domain.', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='spider',
+            name='next_run_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='spider',
+            name='schedule_cron',
+            field=models.CharField(blank=True, help_text='Run on this cron schedule (minute hour day month weekday), instead of the interval.', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='spider',
+            name='schedule_interval',
+            field=models.DurationField(blank=True, help_text='Run this often, e.g. "1:00:00" for every hour.', null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.4 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0014_spider_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='execution',
+            name='time_heartbeat',
+            field=models.DateTimeField(blank=True, help_text='Last sign of life of a running execution.', null=True),
+        ),
+        migrations.AddField(
+            model_name='spider',
+            name='timeout',
+            field=models.PositiveIntegerField(blank=True, help_text='Close the spider after this many seconds. Defaults to SCRATCHY_EXECUTION_TIMEOUT.', null=True),
+        ),
+    ]
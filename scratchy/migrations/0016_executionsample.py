@@ -0,0 +1,36 @@
+# Generated by Django 3.0.4 on 2026-10-18 14:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0015_execution_timeout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExecutionSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField()),
+                ('elapsed_seconds', models.FloatField()),
+                ('requests', models.PositiveIntegerField()),
+                ('responses', models.PositiveIntegerField()),
+                ('items', models.PositiveIntegerField()),
+                ('response_bytes', models.BigIntegerField()),
+                ('requests_per_second', models.FloatField()),
+                ('items_per_second', models.FloatField()),
+                ('latency_p50', models.FloatField(blank=True, null=True)),
+                ('latency_p95', models.FloatField(blank=True, null=True)),
+                ('download_delay', models.FloatField(blank=True, help_text='Average download delay of the active slots (set by autothrottle).', null=True)),
+                ('active_requests', models.PositiveIntegerField(default=0)),
+                ('execution', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scratchy.Execution')),
+            ],
+            options={
+                'ordering': ['execution', 'time'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0016_executionsample'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='execution',
+            name='time_queued',
+            field=models.DateTimeField(blank=True, help_text='When the crawl was queued.', null=True),
+        ),
+    ]
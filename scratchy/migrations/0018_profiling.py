@@ -0,0 +1,28 @@
+# Generated by Django 3.0.4 on 2026-10-18 16:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0017_execution_time_queued'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spider',
+            name='profile',
+            field=models.BooleanField(default=False, help_text='Record the time spent in callbacks and pipelines in the execution stats.'),
+        ),
+        migrations.CreateModel(
+            name='ExecutionProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_created', models.DateTimeField(auto_now_add=True)),
+                ('data', models.BinaryField(help_text='Gzip compressed.')),
+                ('execution', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to='scratchy.Execution')),
+            ],
+        ),
+    ]
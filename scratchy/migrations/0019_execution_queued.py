@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0018_profiling'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='execution',
+            name='time_started',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='Empty while the crawl is queued.', null=True),
+        ),
+    ]
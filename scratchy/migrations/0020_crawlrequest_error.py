@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scratchy', '0019_execution_queued'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawlrequest',
+            name='error',
+            field=models.TextField(blank=True, help_text='Why the crawl could not be started.'),
+        ),
+    ]
@@ -1,8 +1,21 @@
-import pandas as pd
+import gzip
+from datetime import timedelta
+from io import BytesIO
+
 from django.contrib.postgres.fields import JSONField
+from django.core.exceptions import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models
+from django.db import models, transaction
 from django.template.defaultfilters import filesizeformat
+from django.utils.timezone import now
+
+
+def compress(text):
+    return gzip.compress(text.encode('utf-8'))
+
+
+def decompress(data):
+    return gzip.decompress(data).decode('utf-8') if data else ''
 
 
 class Spider(models.Model):
@@ -28,10 +41,31 @@ class Spider(models.Model):
     active = models.BooleanField(default=False, db_index=True)
     settings = JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder, help_text='Scrapy settings object for this spider only.')
     log_level = models.CharField(max_length=20, default=INFO, choices=LOG_LEVEL_CHOICES)
+    item_retention_days = models.PositiveIntegerField(null=True, blank=True, help_text='Delete processed items older than this. Defaults to SCRATCHY_PROCESSED_ITEM_RETENTION_DAYS.')
+    execution_retention_days = models.PositiveIntegerField(null=True, blank=True, help_text='Delete executions older than this. Defaults to SCRATCHY_EXECUTION_RETENTION_DAYS.')
+    domain = models.CharField(max_length=200, blank=True, help_text='Used to limit concurrent executions per domain.')
+    schedule_interval = models.DurationField(null=True, blank=True, help_text='Run this often, e.g. "1:00:00" for every hour.')
+    schedule_cron = models.CharField(max_length=200, blank=True, help_text='Run on this cron schedule (minute hour day month weekday), instead of the interval.')
+    next_run_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    timeout = models.PositiveIntegerField(null=True, blank=True, help_text='Close the spider after this many seconds. Defaults to SCRATCHY_EXECUTION_TIMEOUT.')
+    profile = models.BooleanField(default=False, help_text='Record the time spent in callbacks and pipelines in the execution stats.')
+
+    # denormalized, updated when an execution finishes (see the rebuild_scratchy_counters command)
+    execution_count = models.PositiveIntegerField(default=0, editable=False)
+    last_execution = models.ForeignKey('Execution', null=True, blank=True, editable=False, on_delete=models.SET_NULL, related_name='+')
+    last_finish_reason = models.CharField(max_length=200, blank=True, editable=False)
 
     def __str__(self):
         return f'{self.module}'
 
+    def clean(self):
+        if self.schedule_cron:
+            from .scheduling import parse_cron
+            try:
+                parse_cron(self.schedule_cron)
+            except ValueError as e:
+                raise ValidationError({'schedule_cron': str(e)})
+
     def get_file_name(self):
         return self.module.split('.')[-1]
 
@@ -39,9 +73,40 @@ class Spider(models.Model):
 class Execution(models.Model):
     spider = models.ForeignKey(Spider, on_delete=models.CASCADE)
     stats = JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
-    time_started = models.DateTimeField(db_index=True)
+    time_started = models.DateTimeField(null=True, blank=True, db_index=True, help_text='Empty while the crawl is queued.')
     time_ended = models.DateTimeField(null=True, blank=True)
-    log = models.TextField(blank=True)
+    log_data = models.BinaryField(blank=True, default=b'', help_text='Gzip compressed log.')
+    item_count = models.PositiveIntegerField(default=0, editable=False)  # denormalized, updated as items are saved
+    time_heartbeat = models.DateTimeField(null=True, blank=True, help_text='Last sign of life of a running execution.')
+    time_queued = models.DateTimeField(null=True, blank=True, help_text='When the crawl was queued.')
+
+    @property
+    def log(self):
+        return decompress(self.log_data)
+
+    @log.setter
+    def log(self, value):
+        self.log_data = compress(value)
+
+    def log_tail(self, lines=200):
+        return '\n'.join(self.log.splitlines()[-lines:])
+
+    def iter_log(self, chunk_size=64 * 1024):
+        if not self.log_data:
+            return
+        with gzip.GzipFile(fileobj=BytesIO(self.log_data)) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def update_spider_counters(self):
+        Spider.objects.filter(pk=self.spider_id).update(
+            execution_count=models.F('execution_count') + 1,
+            last_execution=self,
+            last_finish_reason=self.stats.get('finish_reason', ''),
+        )
 
     @property
     def responses(self):
@@ -58,9 +123,33 @@ class Execution(models.Model):
 
     @property
     def seconds(self):
+        if self.is_queued:
+            return 0
+        if self.is_running:
+            return int((now() - self.time_started).total_seconds())
         return int(self.stats.get('elapsed_time_seconds', 0))
 
-    def items_as_df(self, stringify_datetime=False) -> pd.DataFrame:
+    @property
+    def is_queued(self):
+        return self.time_started is None and self.time_ended is None
+
+    @property
+    def is_running(self):
+        return self.time_ended is None
+
+    @property
+    def items_per_second(self):
+        """
+        The recent item rate of a running execution, the average rate of a finished one.
+        """
+        if self.is_running:
+            return self.stats.get('scratchy/items_per_second', 0)
+        seconds = self.stats.get('elapsed_time_seconds', 0)
+        return round(self.stats.get('item_scraped_count', 0) / seconds, 2) if seconds else 0
+
+    def items_as_df(self, stringify_datetime=False) -> 'pd.DataFrame':
+        import pandas as pd  # slow to import, only needed here
+
         items = Item.objects.filter(execution=self)
 
         records = []
@@ -74,6 +163,62 @@ class Execution(models.Model):
 
         return pd.DataFrame.from_records(records)
 
+    def items_as_arrow(self):
+        """
+        Returns the items as a pyarrow Table, requires pyarrow.
+        """
+        from .exports import items_as_arrow
+        return items_as_arrow(self)
+
+    def items_as_parquet(self, path, compression='zstd'):
+        """
+        Writes the items to a Parquet file, requires pyarrow.
+        """
+        from .exports import write_parquet
+        write_parquet(self, path, compression=compression)
+
+
+class ItemQuerySet(models.QuerySet):
+
+    def claim_batch(self, spider=None, size=1000, lease=timedelta(minutes=5)):
+        """
+        Claims up to size unprocessed items that are not claimed by another consumer.
+
+        Rows are selected with SELECT ... FOR UPDATE SKIP LOCKED so concurrent consumers
+        never receive the same items. A claim expires after lease, after which the items
+        can be claimed again unless they have been marked as processed.
+        """
+        with transaction.atomic():
+            qs = self.filter(processed=False).filter(models.Q(claimed_until__isnull=True) | models.Q(claimed_until__lt=now()))
+            if spider is not None:
+                qs = qs.filter(spider=spider)
+            ids = list(qs.order_by('id').select_for_update(skip_locked=True).values_list('id', flat=True)[:size])
+            self.model.objects.filter(id__in=ids).update(claimed_until=now() + lease)
+
+        return list(self.model.objects.filter(id__in=ids).order_by('id'))
+
+    def iter_claimed_batches(self, spider=None, size=1000, lease=timedelta(minutes=5), acknowledge=True):
+        """
+        Yields claimed batches until no unprocessed items are left.
+
+        With acknowledge, a batch is marked as processed when the next batch is
+        requested. If the consumer raises, the batch is not acknowledged and is
+        claimed again once the lease expires.
+        """
+        while True:
+            batch = self.claim_batch(spider=spider, size=size, lease=lease)
+            if not batch:
+                return
+            yield batch
+            if acknowledge:
+                self.model.objects.filter(id__in=[item.id for item in batch]).mark_processed()
+
+    def mark_processed(self):
+        return self.update(processed=True, claimed_until=None)
+
+    def release(self):
+        return self.update(claimed_until=None)
+
 
 class Item(models.Model):
     time_created = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -81,3 +226,109 @@ class Item(models.Model):
     execution = models.ForeignKey(Execution, null=True, on_delete=models.SET_NULL)
     data = JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
     processed = models.BooleanField(default=False, db_index=True)
+    claimed_until = models.DateTimeField(null=True, blank=True, editable=False)
+    data_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)  # only set for spiders with dedup
+
+    objects = ItemQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['spider', 'id'], condition=models.Q(processed=False), name='scratchy_item_unprocessed'),
+        ]
+        constraints = [
+            # a plain index on partitioned tables, see migration 0011
+            models.UniqueConstraint(fields=['spider', 'data_hash'], name='scratchy_item_unique_hash'),
+        ]
+
+
+class CrawlRequest(models.Model):
+    """
+    A request to run a spider on a long-lived crawl worker (see the crawl_worker command).
+    """
+    spider = models.ForeignKey(Spider, on_delete=models.CASCADE)
+    time_created = models.DateTimeField(auto_now_add=True, db_index=True)
+    time_claimed = models.DateTimeField(null=True, blank=True)
+    execution = models.ForeignKey(Execution, null=True, blank=True, on_delete=models.SET_NULL)
+    error = models.TextField(blank=True, help_text='Why the crawl could not be started.')
+
+    def __str__(self):
+        return f'{self.spider} @ {self.time_created}'
+
+
+class SeenRequest(models.Model):
+    """
+    A request fetched by an earlier execution, see SeenRequestMiddleware.
+    """
+    spider = models.ForeignKey(Spider, on_delete=models.CASCADE)
+    fingerprint = models.CharField(max_length=64)
+    url = models.TextField()
+    time_seen = models.DateTimeField()
+    etag = models.CharField(max_length=200, blank=True)
+    last_modified = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['spider', 'fingerprint'], name='scratchy_seenrequest_unique_fingerprint'),
+        ]
+
+    def __str__(self):
+        return self.url
+
+
+class CachedResponse(models.Model):
+    """
+    A response stored by DatabaseCacheStorage, shared by all workers.
+    """
+    spider = models.ForeignKey(Spider, on_delete=models.CASCADE)
+    fingerprint = models.CharField(max_length=64)
+    url = models.TextField()
+    status = models.PositiveSmallIntegerField()
+    headers = JSONField(default=dict, blank=True)
+    body = models.BinaryField(help_text='Gzip compressed body.')
+    size = models.PositiveIntegerField(help_text='Size of the compressed body in bytes.')
+    time_stored = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['spider', 'fingerprint'], name='scratchy_cachedresponse_unique_fingerprint'),
+        ]
+
+    def __str__(self):
+        return self.url
+
+
+class ExecutionSample(models.Model):
+    """
+    Throughput of an execution at a point in time, see ExecutionSampler.
+
+    Counters are totals since the start of the execution, rates and latencies are
+    for the interval since the previous sample.
+    """
+    execution = models.ForeignKey(Execution, on_delete=models.CASCADE)
+    time = models.DateTimeField()
+    elapsed_seconds = models.FloatField()
+    requests = models.PositiveIntegerField()
+    responses = models.PositiveIntegerField()
+    items = models.PositiveIntegerField()
+    response_bytes = models.BigIntegerField()
+    requests_per_second = models.FloatField()
+    items_per_second = models.FloatField()
+    latency_p50 = models.FloatField(null=True, blank=True)
+    latency_p95 = models.FloatField(null=True, blank=True)
+    download_delay = models.FloatField(null=True, blank=True, help_text='Average download delay of the active slots (set by autothrottle).')
+    active_requests = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['execution', 'time']
+
+
+class ExecutionProfile(models.Model):
+    """
+    cProfile output of a profiled execution, in the format of pstats.Stats.dump_stats.
+    """
+    execution = models.OneToOneField(Execution, on_delete=models.CASCADE, related_name='profile')
+    time_created = models.DateTimeField(auto_now_add=True)
+    data = models.BinaryField(help_text='Gzip compressed.')
+
+    def get_stats_data(self):
+        return gzip.decompress(self.data)
@@ -0,0 +1,254 @@
+"""
+Optional range partitioning of the item table on time_created (PostgreSQL 11+).
+
+With SCRATCHY_ITEM_PARTITION_INTERVAL set to 'day' or 'month', the item table is
+converted to a partitioned table (by migration 0009 or the item_partitions command).
+Existing rows are kept in a single legacy partition. Retention is then applied by
+detaching and dropping whole partitions instead of deleting rows.
+"""
+import logging
+import re
+from datetime import timedelta, timezone
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'scratchy_item'  # not read from the models, this module is used by migrations
+EXECUTION_TABLE = 'scratchy_execution'
+
+DAY = 'day'
+MONTH = 'month'
+
+INTERVALS = (DAY, MONTH)
+
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def get_interval():
+    interval = getattr(settings, 'SCRATCHY_ITEM_PARTITION_INTERVAL', None)
+    if interval is not None and interval not in INTERVALS:
+        raise ValueError(f'SCRATCHY_ITEM_PARTITION_INTERVAL must be one of {", ".join(INTERVALS)}')
+    return interval
+
+
+def period_start(dt, interval):
+    dt = dt.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == MONTH:
+        dt = dt.replace(day=1)
+    return dt
+
+
+def next_period(dt, interval):
+    if interval == MONTH:
+        return (dt.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return dt + timedelta(days=1)
+
+
+def partition_name(start, interval):
+    return f'{TABLE}_p{start:%Y%m}' if interval == MONTH else f'{TABLE}_p{start:%Y%m%d}'
+
+
+def is_partitioned(cursor):
+    cursor.execute('SELECT relkind FROM pg_class WHERE oid = %s::regclass', [TABLE])
+    return cursor.fetchone()[0] == 'p'
+
+
+def get_partitions(cursor):
+    """
+    Returns [(name, upper bound)] of the partitions of the item table, the upper
+    bound is None for the default partition.
+    """
+    cursor.execute(
+        'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass',
+        [TABLE],
+    )
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = UPPER_BOUND.search(bound)
+        partitions.append((name, parse_datetime(match.group(1)) if match else None))
+    return partitions
+
+
+def convert(interval, using=DEFAULT_DB_ALIAS):
+    """
+    Converts the item table to a table partitioned by range on time_created.
+
+    The existing table is attached as a partition holding all rows up to the end of
+    the current period. Indexes and foreign keys are recreated on the new table,
+    the primary key becomes (id, time_created) as required by PostgreSQL. Unique
+    indexes that do not include time_created are not allowed on partitioned tables
+    and are recreated as plain indexes.
+
+    The CHECK constraint matching the partition bound and the (id, time_created)
+    index are built first, so attaching the table does not scan it while holding
+    an exclusive lock. Outside of a transaction the index is built concurrently.
+    Items can't be inserted after the end of the current period until the
+    conversion is done.
+    """
+    connection = connections[using]
+    legacy = f'{TABLE}_legacy'
+    check = f'{TABLE}_partition_bound'
+    unique = f'{TABLE}_id_time_created_uniq'
+    q = connection.ops.quote_name
+
+    with connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return
+
+        boundary = next_period(period_start(now(), interval), interval)
+        cursor.execute(f'SELECT max(time_created) FROM {q(TABLE)}')
+        newest = cursor.fetchone()[0]
+        if newest is not None and newest >= boundary:
+            boundary = next_period(period_start(newest, interval), interval)
+
+        with transaction.atomic(using=using):
+            cursor.execute(f'ALTER TABLE {q(TABLE)} DROP CONSTRAINT IF EXISTS {q(check)}')  # left by an interrupted run
+            cursor.execute(
+                f'ALTER TABLE {q(TABLE)} ADD CONSTRAINT {q(check)} '
+                f'CHECK (time_created IS NOT NULL AND time_created < %s) NOT VALID', [boundary],
+            )
+        cursor.execute(f'ALTER TABLE {q(TABLE)} VALIDATE CONSTRAINT {q(check)}')  # doesn't block writes
+        concurrently = '' if connection.in_atomic_block else 'CONCURRENTLY'
+        cursor.execute(f'DROP INDEX {concurrently} IF EXISTS {q(unique)}')
+        cursor.execute(f'CREATE UNIQUE INDEX {concurrently} {q(unique)} ON {q(TABLE)} (id, time_created)')
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'", [TABLE],
+        )
+        primary_key = cursor.fetchone()[0]
+        cursor.execute(
+            'SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN (%s, %s)',
+            [TABLE, primary_key, unique],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'", [TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [TABLE, 'id'])
+        sequence = cursor.fetchone()[0]
+
+        # free the index names so they can be reused on the new table
+        cursor.execute(f'ALTER TABLE {q(TABLE)} RENAME TO {q(legacy)}')
+        cursor.execute(f'ALTER TABLE {q(legacy)} RENAME CONSTRAINT {q(primary_key)} TO {q(legacy + "_pkey")}')
+        for name, _ in indexes:
+            cursor.execute(f'ALTER INDEX {q(name)} RENAME TO {q(name[:56] + "_legacy")}')
+
+        cursor.execute(
+            f'CREATE TABLE {q(TABLE)} (LIKE {q(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE (time_created)'
+        )
+        cursor.execute(f'ALTER TABLE {q(TABLE)} DROP CONSTRAINT IF EXISTS {q(check)}')  # copied by LIKE
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {q(TABLE)}.id')
+        cursor.execute(f'ALTER TABLE {q(TABLE)} ADD CONSTRAINT {q(primary_key)} PRIMARY KEY (id, time_created)')
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {q(TABLE)} ADD CONSTRAINT {q(name)} {definition}')
+        for name, definition in indexes:
+            # the definitions refer to the original table and index names
+            cursor.execute(definition.replace('CREATE UNIQUE INDEX', 'CREATE INDEX', 1))
+
+        # uses the validated constraint instead of scanning, and the unique index for the primary key
+        cursor.execute(
+            f'ALTER TABLE {q(TABLE)} ATTACH PARTITION {q(legacy)} FOR VALUES FROM (MINVALUE) TO (%s)', [boundary],
+        )
+        cursor.execute(f'ALTER TABLE {q(legacy)} DROP CONSTRAINT {q(check)}')
+        cursor.execute(f'CREATE TABLE {q(TABLE + "_default")} PARTITION OF {q(TABLE)} DEFAULT')
+
+    create_partitions(interval, using=using)
+
+
+def create_partitions(interval, ahead=3, using=DEFAULT_DB_ALIAS):
+    """
+    Creates partitions for the current period and the next ahead periods, skipping
+    periods that are already covered by an existing partition.
+    """
+    connection = connections[using]
+    q = connection.ops.quote_name
+    created = []
+
+    with connection.cursor() as cursor:
+        bounds = [upper for _, upper in get_partitions(cursor) if upper is not None]
+        start = period_start(now(), interval)
+        end_of_ahead = start
+        for _ in range(ahead + 1):
+            end_of_ahead = next_period(end_of_ahead, interval)
+        if bounds:
+            start = max(start, max(bounds))
+
+        while start < end_of_ahead:
+            end = next_period(start, interval)
+            name = partition_name(start, interval)
+            try:
+                with transaction.atomic(using=using):
+                    cursor.execute(
+                        f'CREATE TABLE {q(name)} PARTITION OF {q(TABLE)} FOR VALUES FROM (%s) TO (%s)', [start, end],
+                    )
+                created.append(name)
+            except Exception:
+                # the default partition already holds rows in this range, these must be moved by hand
+                logger.exception(f'Could not create item partition {name}')
+                break
+            start = end
+
+    return created
+
+
+def drop_expired_partitions(retention_days, drop=True, unprocessed=False, using=DEFAULT_DB_ALIAS):
+    """
+    Detaches (and drops) partitions that only contain items older than retention_days.
+
+    Partitions still holding unprocessed items are skipped with a warning, unless
+    unprocessed is set.
+    """
+    connection = connections[using]
+    q = connection.ops.quote_name
+    cutoff = now() - timedelta(days=retention_days)
+    removed = []
+
+    with connection.cursor() as cursor:
+        for name, upper in get_partitions(cursor):
+            if upper is None or upper > cutoff:
+                continue
+            if not unprocessed:
+                cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {q(name)} WHERE NOT processed)')
+                if cursor.fetchone()[0]:
+                    logger.warning(f'Not removing item partition {name}, it holds unprocessed items')
+                    continue
+            with transaction.atomic(using=using):
+                # keep the denormalized item counters of the executions in line
+                cursor.execute(
+                    f'UPDATE {q(EXECUTION_TABLE)} e SET item_count = GREATEST(e.item_count - c.n, 0) '
+                    f'FROM (SELECT execution_id, count(*) AS n FROM {q(name)} '
+                    f'WHERE execution_id IS NOT NULL GROUP BY execution_id) c WHERE e.id = c.execution_id'
+                )
+                cursor.execute(f'ALTER TABLE {q(TABLE)} DETACH PARTITION {q(name)}')
+                if drop:
+                    cursor.execute(f'DROP TABLE {q(name)}')
+            removed.append(name)
+
+    return removed
+
+
+def maintain():
+    """
+    Creates upcoming partitions and removes expired ones according to the settings.
+    """
+    interval = get_interval()
+    if interval is None:
+        return [], []
+
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        if not is_partitioned(cursor):
+            return [], []
+
+    created = create_partitions(interval, ahead=getattr(settings, 'SCRATCHY_ITEM_PARTITIONS_AHEAD', 3))
+    retention_days = getattr(settings, 'SCRATCHY_ITEM_RETENTION_DAYS', None)
+    unprocessed = getattr(settings, 'SCRATCHY_ITEM_RETENTION_UNPROCESSED', False)
+    removed = drop_expired_partitions(retention_days, unprocessed=unprocessed) if retention_days is not None else []
+    return created, removed
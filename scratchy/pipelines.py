@@ -0,0 +1,113 @@
+import logging
+import time
+
+from django.db.models import F
+from itemadapter import ItemAdapter
+from scrapy.exceptions import DropItem
+from twisted.internet import task
+
+from .ingest import BULK_CREATE, check_dedup, get_data_hash, get_method, save_items, to_json_data
+from .metrics import get_metrics
+from .models import Execution, Item
+from .profiling import add_timing
+
+logger = logging.getLogger(__name__)
+
+
+class ItemStoragePipeline:
+    """
+    Saves scraped items to the database while the crawl is running.
+
+    Items are buffered and written in batches, either when SCRATCHY_ITEM_BATCH_SIZE
+    items have been collected or every SCRATCHY_ITEM_FLUSH_INTERVAL seconds,
+    whichever comes first. SCRATCHY_ITEM_INGEST selects how batches are written.
+
+    With SCRATCHY_ITEM_DEDUP set, items already seen for the spider are skipped
+    ('skip') or updated ('update'), based on a hash of the item or of the fields in
+    SCRATCHY_ITEM_DEDUP_FIELDS. Counts are recorded in the scratchy/items_* stats.
+    """
+
+    def __init__(self, spider_id, execution_id, batch_size=100, flush_interval=5.0, ingest_method=BULK_CREATE,
+                 dedup=None, dedup_fields=None, stats=None, profile=False):
+        self.spider_id = spider_id
+        self.execution_id = execution_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ingest_method = ingest_method
+        self.dedup = dedup
+        self.dedup_fields = dedup_fields
+        self.stats = stats
+        self.profile = profile
+        self.buffer = []
+        self.loop = None
+        self.spider_name = None
+        self.metrics = get_metrics()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        ingest_method = settings.get('SCRATCHY_ITEM_INGEST', BULK_CREATE)
+        get_method(ingest_method)  # invalid settings fail the crawl here rather than every batch in flush
+        return cls(
+            spider_id=settings.getint('SCRATCHY_SPIDER_ID'),
+            execution_id=settings.getint('SCRATCHY_EXECUTION_ID'),
+            batch_size=settings.getint('SCRATCHY_ITEM_BATCH_SIZE', 100),
+            flush_interval=settings.getfloat('SCRATCHY_ITEM_FLUSH_INTERVAL', 5.0),
+            ingest_method=ingest_method,
+            dedup=check_dedup(settings.get('SCRATCHY_ITEM_DEDUP')),
+            dedup_fields=settings.getlist('SCRATCHY_ITEM_DEDUP_FIELDS'),
+            stats=crawler.stats,
+            profile=settings.getbool('SCRATCHY_PROFILE'),
+        )
+
+    def open_spider(self, spider):
+        self.spider_name = spider.name
+        if self.flush_interval > 0:
+            self.loop = task.LoopingCall(self.flush)
+            self.loop.start(self.flush_interval, now=False)
+
+    def close_spider(self, spider):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.flush()
+
+    def process_item(self, item, spider):
+        try:
+            # encode here so a bad item fails on its own instead of failing the batch
+            data = to_json_data(ItemAdapter(item).asdict())
+        except (TypeError, ValueError) as e:
+            raise DropItem(f'Item is not JSON serializable: {e}')
+        self.buffer.append(Item(
+            spider_id=self.spider_id,
+            execution_id=self.execution_id,
+            data=data,
+            data_hash=get_data_hash(data, self.dedup_fields) if self.dedup else None,
+        ))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        return item
+
+    def flush(self):
+        if not self.buffer:
+            return
+        items, self.buffer = self.buffer, []
+        t = time.monotonic()
+        try:
+            counts = save_items(items, method=self.ingest_method, dedup=self.dedup)
+        except Exception:
+            # also keeps the periodic flush running
+            logger.exception(f'Could not save {len(items)} items of execution {self.execution_id}')
+            if self.stats is not None:
+                self.stats.inc_value('scratchy/items_failed', len(items))
+            return
+        if self.profile and self.stats is not None:
+            add_timing(self.stats, 'ingest', round(time.monotonic() - t, 6))
+        if self.metrics is not None:
+            method = self.dedup or get_method(self.ingest_method)
+            self.metrics.ingest_batch.labels(self.spider_name, method).observe(time.monotonic() - t)
+        saved = counts['new'] + counts['updated']
+        if saved:
+            Execution.objects.filter(pk=self.execution_id).update(item_count=F('item_count') + saved)
+        if self.stats is not None:
+            for key, value in counts.items():
+                self.stats.inc_value(f'scratchy/items_{key}', value)
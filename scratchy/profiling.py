@@ -0,0 +1,152 @@
+"""
+Opt-in profiling of executions, enabled per spider with Spider.profile or with the
+SCRATCHY_PROFILE setting.
+
+Time spent in each callback and pipeline is added to the execution stats under
+scratchy/profile/. With SCRATCHY_PROFILE_CPROFILE the crawl also runs under
+cProfile and the output is saved as an ExecutionProfile.
+"""
+import cProfile
+import gzip
+import logging
+import marshal
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet.defer import Deferred
+
+from .models import ExecutionProfile
+
+logger = logging.getLogger(__name__)
+
+
+def add_timing(stats, key, seconds):
+    stats.inc_value(f'scratchy/profile/{key}/seconds', seconds)
+    stats.inc_value(f'scratchy/profile/{key}/calls')
+
+
+class CallbackTimingMiddleware:
+    """
+    Spider middleware timing the callbacks that produced each response's output.
+
+    Callbacks are usually generators, so the time is measured while their output
+    is consumed, excluding the time spent by other middlewares.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('SCRATCHY_PROFILE'):
+            raise NotConfigured
+        return cls(crawler.stats)
+
+    def get_key(self, response):
+        callback = getattr(response.request, 'callback', None)
+        return f'callback/{getattr(callback, "__name__", "parse")}'
+
+    def process_spider_output(self, response, result, spider):
+        it = iter(result)
+        seconds = 0.0
+        while True:
+            t = time.perf_counter()
+            try:
+                output = next(it)
+            except StopIteration:
+                add_timing(self.stats, self.get_key(response), round(seconds + time.perf_counter() - t, 6))
+                return
+            seconds += time.perf_counter() - t
+            yield output
+
+    async def process_spider_output_async(self, response, result, spider):
+        # async callbacks, scrapy >= 2.7
+        it = result.__aiter__()
+        seconds = 0.0
+        while True:
+            t = time.perf_counter()
+            try:
+                output = await it.__anext__()
+            except StopAsyncIteration:
+                add_timing(self.stats, self.get_key(response), round(seconds + time.perf_counter() - t, 6))
+                return
+            seconds += time.perf_counter() - t
+            yield output
+
+
+class ProfileExtension:
+    """
+    Times the item pipelines and the downloads, and optionally runs the crawl under
+    cProfile (SCRATCHY_PROFILE_CPROFILE).
+    """
+
+    def __init__(self, crawler, execution_id, cprofile=False):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.execution_id = execution_id
+        self.profiler = cProfile.Profile() if cprofile else None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('SCRATCHY_PROFILE'):
+            raise NotConfigured
+        extension = cls(
+            crawler,
+            execution_id=settings.getint('SCRATCHY_EXECUTION_ID'),
+            cprofile=settings.getbool('SCRATCHY_PROFILE_CPROFILE'),
+        )
+        crawler.signals.connect(extension.engine_started, signal=signals.engine_started)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def engine_started(self):
+        self.wrap_pipelines()
+        if self.profiler is not None:
+            try:
+                self.profiler.enable()
+            except ValueError:  # another profiler is active, e.g. for another spider in this process
+                logger.warning('Could not start cProfile, another profiler is active')
+                self.profiler = None
+
+    def wrap_pipelines(self):
+        try:
+            methods = self.crawler.engine.scraper.itemproc.methods['process_item']
+        except AttributeError:
+            logger.warning('Could not time the item pipelines of this Scrapy version')
+            return
+        for i, method in enumerate(methods):
+            # bound methods, or functions wrapping them in newer scrapy versions
+            name = getattr(method, '__qualname__', type(method).__name__).rsplit('.', 1)[0]
+            methods[i] = self.timed(method, f'pipeline/{name}')
+
+    def timed(self, method, key):
+        def wrapper(item, spider):
+            t = time.perf_counter()
+            result = method(item, spider)
+            if isinstance(result, Deferred):
+                def done(value):
+                    add_timing(self.stats, key, round(time.perf_counter() - t, 6))
+                    return value
+                return result.addBoth(done)
+            add_timing(self.stats, key, round(time.perf_counter() - t, 6))
+            return result
+
+        return wrapper
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            add_timing(self.stats, 'download', latency)
+
+    def spider_closed(self, spider):
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        self.profiler.create_stats()
+        ExecutionProfile.objects.update_or_create(
+            execution_id=self.execution_id,
+            defaults=dict(data=gzip.compress(marshal.dumps(self.profiler.stats))),
+        )
@@ -0,0 +1,132 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from django.utils.timezone import now
+
+from .models import Spider, Execution, Item
+
+logger = logging.getLogger(__name__)
+
+
+class Purge:
+    """
+    Deletes processed items and old executions in small batches.
+
+    Rows are selected in primary key order, batch_size at a time, with a pause of
+    sleep seconds between batches so other queries are not starved. The purge stops
+    after max_runtime seconds, the next run continues where it left off because
+    only rows that still match are selected.
+    """
+
+    def __init__(self, batch_size=1000, sleep=0.1, max_runtime=None, report=None):
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.max_runtime = max_runtime
+        self.report = report or logger.info
+        self.started = time.monotonic()
+        self.deleted = 0
+
+    def out_of_time(self):
+        return self.max_runtime is not None and time.monotonic() - self.started >= self.max_runtime
+
+    def run(self, spiders=None):
+        if spiders is None:
+            spiders = Spider.objects.all()
+
+        default_item_days = getattr(settings, 'SCRATCHY_PROCESSED_ITEM_RETENTION_DAYS', None)
+        default_execution_days = getattr(settings, 'SCRATCHY_EXECUTION_RETENTION_DAYS', None)
+
+        for spider in spiders:
+            item_days = spider.item_retention_days if spider.item_retention_days is not None else default_item_days
+            if item_days is not None:
+                items = Item.objects.filter(spider=spider, processed=True, time_created__lt=now() - timedelta(days=item_days))
+                self.delete(items, f'processed items of {spider}')
+
+            execution_days = spider.execution_retention_days if spider.execution_retention_days is not None else default_execution_days
+            if execution_days is not None:
+                executions = Execution.objects.filter(spider=spider, time_started__lt=now() - timedelta(days=execution_days))
+                self.delete_executions(executions, f'executions of {spider}')
+
+            if self.out_of_time():
+                self.report('Maximum runtime reached, stopping')
+                break
+
+        return self.deleted
+
+    def batches(self, qs):
+        """
+        Yields lists of primary keys of rows matching qs, in order.
+        """
+        last_id = 0
+        while not self.out_of_time():
+            ids = list(qs.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:self.batch_size])
+            if not ids:
+                return
+            yield ids
+            last_id = ids[-1]
+            if self.sleep:
+                time.sleep(self.sleep)
+
+    def delete(self, qs, label):
+        total = 0
+        t = time.monotonic()
+        for ids in self.batches(qs):
+            with transaction.atomic():
+                if qs.model is Item:
+                    self.decrement_counts(Item.objects.filter(id__in=ids), 'execution', Execution, 'item_count')
+                deleted, _ = qs.model.objects.filter(id__in=ids).delete()
+            total += deleted
+            self.report(f'Deleted {total} {label} ({total / (time.monotonic() - t):.0f} rows/sec)')
+        self.deleted += total
+        return total
+
+    def delete_executions(self, qs, label):
+        """
+        Deletes executions together with their logs. Items of these executions are
+        kept (as on_delete=SET_NULL would), but are detached in batches first so the
+        delete itself does not have to update them in one statement.
+        """
+        total = 0
+        t = time.monotonic()
+        for ids in self.batches(qs):
+            items = Item.objects.filter(execution_id__in=ids)
+            for item_ids in self.batches(items):
+                Item.objects.filter(id__in=item_ids).update(execution=None)
+            if self.out_of_time():
+                break
+            with transaction.atomic():
+                # only ended executions are counted
+                self.decrement_counts(
+                    Execution.objects.filter(id__in=ids, time_ended__isnull=False), 'spider', Spider, 'execution_count',
+                )
+                deleted, _ = Execution.objects.filter(id__in=ids).delete()
+            total += deleted
+            self.report(f'Deleted {total} {label} ({total / (time.monotonic() - t):.0f} rows/sec)')
+        self.deleted += total
+        return total
+
+    @staticmethod
+    def decrement_counts(qs, parent, model, field):
+        """
+        Decrements the denormalized counter field of the parent rows of the rows in qs,
+        before they are deleted.
+        """
+        counts = qs.order_by().values(parent).annotate(n=Count('id')).values_list(parent, 'n')
+        for parent_id, n in counts:
+            if parent_id is not None:
+                model.objects.filter(pk=parent_id).update(**{field: Greatest(F(field) - n, Value(0))})
+
+    def delete_spider(self, spider):
+        """
+        Deletes a spider after deleting its items and executions in batches.
+        """
+        self.delete(Item.objects.filter(spider=spider), f'items of {spider}')
+        self.delete_executions(Execution.objects.filter(spider=spider), f'executions of {spider}')
+        if not self.out_of_time():
+            spider.delete()
+            self.report(f'Deleted spider {spider}')
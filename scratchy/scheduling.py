@@ -0,0 +1,95 @@
+from collections import Counter
+
+from celery.schedules import crontab
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils.timezone import now
+
+from .models import Spider, Execution
+
+
+def parse_cron(expression, nowfun=None):
+    """
+    Returns a celery crontab for a standard five field cron expression.
+    """
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError('Cron expression must have five fields: minute hour day month weekday')
+    minute, hour, day_of_month, month_of_year, day_of_week = fields
+    return crontab(
+        minute=minute,
+        hour=hour,
+        day_of_month=day_of_month,
+        month_of_year=month_of_year,
+        day_of_week=day_of_week,
+        nowfun=nowfun,
+    )
+
+
+def get_next_run(spider, after):
+    if spider.schedule_cron:
+        schedule = parse_cron(spider.schedule_cron, nowfun=lambda: after)
+        return after + schedule.remaining_estimate(after)
+    if spider.schedule_interval:
+        return after + spider.schedule_interval
+    return None
+
+
+def running_executions():
+    """
+    Executions that have not ended, including queued executions that have not started yet.
+    """
+    return Execution.objects.filter(time_ended__isnull=True)
+
+
+def schedule_due_spiders():
+    """
+    Creates queued executions for the active spiders that are due to run, advances
+    their next_run_at and returns the executions, to be passed to run_spider.
+
+    Spiders with a queued or running execution are skipped and stay due. At most
+    SCRATCHY_MAX_CONCURRENT_EXECUTIONS executions run at the same time, and at most
+    SCRATCHY_MAX_CONCURRENT_EXECUTIONS_PER_DOMAIN for spiders with the same domain.
+    Spiders are locked while they are scheduled so concurrent schedulers don't
+    pick the same spider.
+    """
+    max_total = getattr(settings, 'SCRATCHY_MAX_CONCURRENT_EXECUTIONS', None)
+    max_per_domain = getattr(settings, 'SCRATCHY_MAX_CONCURRENT_EXECUTIONS_PER_DOMAIN', None)
+    timestamp = now()
+    scheduled = []
+
+    has_schedule = Q(schedule_interval__isnull=False) | ~Q(schedule_cron='')
+
+    with transaction.atomic():
+        running = running_executions()
+        running_total = running.count()
+        running_per_domain = Counter(running.exclude(spider__domain='').values_list('spider__domain', flat=True))
+
+        due = (
+            Spider.objects
+            .filter(active=True)
+            .filter(has_schedule)
+            .filter(Q(next_run_at__lte=timestamp) | Q(next_run_at__isnull=True))
+            .annotate(is_running=Exists(running.filter(spider_id=OuterRef('pk'))))
+            .filter(is_running=False)
+            .order_by('next_run_at')
+            .select_for_update(skip_locked=True, of=('self',))
+        )
+
+        for spider in due:
+            if max_total is not None and running_total >= max_total:
+                break
+            if spider.domain and max_per_domain is not None and running_per_domain[spider.domain] >= max_per_domain:
+                continue
+
+            spider.next_run_at = get_next_run(spider, timestamp)
+            spider.save(update_fields=['next_run_at'])
+
+            # counted as running by the next call, also while the task waits in the queue
+            scheduled.append(Execution.objects.create(spider=spider, time_queued=timestamp))
+            running_total += 1
+            if spider.domain:
+                running_per_domain[spider.domain] += 1
+
+    return scheduled
@@ -1,33 +1,118 @@
 import importlib
-import json
 import logging
-import os
-import tempfile
-from io import StringIO
+import time
+from functools import lru_cache
 
 from celery import shared_task
+from celery.signals import worker_init
 from django.conf import settings
+from django.db import connections
 from django.utils.timezone import now
+from scrapy import signals
 from scrapy.crawler import Crawler, CrawlerProcess
+from scrapy.settings import Settings
 from scrapy.utils.spider import iter_spider_classes
 
-from .models import Spider as SpiderModel, Execution, Item
+from . import partitions, scheduling, watchdog
+from .log import ExecutionLogHandler
+from .metrics import compact_files, get_metrics
+from .models import Spider as SpiderModel, Execution
+from .purge import Purge
+
+logger = logging.getLogger(__name__)
+
+FAILED = 'failed_to_start'
 
 
 @shared_task
 def start_spiders():
-    for spider in SpiderModel.objects.all():
-        run_spider.delay(spider.id)
+    for spider in SpiderModel.objects.filter(active=True):
+        queue_spider(spider.id)
 
 
 @shared_task
-def run_spider(spider_id):
-    spider = SpiderModel.objects.get(id=spider_id)
-    execution = Execution.objects.create(spider_id=spider_id, time_started=now())
+def schedule_due_spiders():
+    for execution in scheduling.schedule_due_spiders():
+        send_run_spider(execution)
 
-    user_settings = getattr(settings, 'SCRATCHY_SPIDERS', {})
 
-    item_storage = tempfile.NamedTemporaryFile(delete=False)
+def queue_spider(spider_id):
+    """
+    Creates a queued execution and a run_spider task that starts it.
+
+    The scheduler counts queued executions as running, so a backed up queue does
+    not lead to more spiders being queued than the concurrency limits allow.
+    """
+    execution = Execution.objects.create(spider=SpiderModel.objects.get(id=spider_id), time_queued=now())
+    return send_run_spider(execution)
+
+
+def send_run_spider(execution):
+    """
+    Sends the run_spider task of a queued execution. With a timeout, the task gets a
+    celery time_limit of the timeout plus SCRATCHY_EXECUTION_TIME_LIMIT_GRACE seconds
+    (default 300), which kills crawls that don't close by themselves.
+    """
+    options = {}
+    timeout = get_timeout(execution.spider)
+    if timeout:
+        options['time_limit'] = timeout + getattr(settings, 'SCRATCHY_EXECUTION_TIME_LIMIT_GRACE', 300)
+    return run_spider.apply_async((execution.spider_id,), {'execution_id': execution.id}, **options)
+
+
+@lru_cache(maxsize=None)
+def get_spider_class(module_name):
+    """
+    Returns the spider class of a module, cached for the lifetime of the process.
+    """
+    module = importlib.import_module(module_name)
+
+    for cls in iter_spider_classes(module):
+        return cls  # use first valid class in module
+
+    raise RuntimeError(f'No valid spider class found in module {module}')
+
+
+def preload_spiders():
+    """
+    Imports and validates the spider classes of all active spiders. Processes
+    forked afterwards start with the modules loaded and the classes cached.
+    """
+    loaded = 0
+    for spider in SpiderModel.objects.filter(active=True).only('module'):
+        try:
+            get_spider_class(spider.module)
+            loaded += 1
+        except Exception:
+            logger.exception(f'Could not load spider {spider}')
+    return loaded
+
+
+@worker_init.connect
+def preload_spiders_on_worker_init(sender=None, **kwargs):
+    # runs in the main worker process before the pool processes are forked
+    if getattr(settings, 'SCRATCHY_PRELOAD_SPIDERS', True):
+        t = time.monotonic()
+        loaded = preload_spiders()
+        connections.close_all()  # don't share the connection with the forked processes
+        logger.info(f'Preloaded {loaded} spiders in {time.monotonic() - t:.2f} seconds')
+
+
+def get_timeout(spider):
+    """
+    Returns the timeout of a spider in seconds: Spider.timeout, CLOSESPIDER_TIMEOUT of
+    the spider or user settings, or SCRATCHY_EXECUTION_TIMEOUT.
+    """
+    if spider.timeout:
+        return spider.timeout
+    user_timeout = {**getattr(settings, 'SCRATCHY_SPIDERS', {}), **spider.settings}.get('CLOSESPIDER_TIMEOUT')
+    if user_timeout:
+        return float(user_timeout)
+    return getattr(settings, 'SCRATCHY_EXECUTION_TIMEOUT', None)
+
+
+def get_scrapy_settings(spider, execution):
+    user_settings = getattr(settings, 'SCRATCHY_SPIDERS', {})
 
     default_settings = {
         'DNS_TIMEOUT': 5,
@@ -38,68 +123,255 @@ def run_spider(spider_id):
         'AUTOTHROTTLE_TARGET_CONCURRENCY': 1.0,
     }
 
-    internal_settings = {
-        'FEED_FORMAT': 'jsonlines',
-        'FEED_EXPORT_ENCODING': 'utf-8',
-        'FEED_URI': item_storage.name,
-
-    }
-
     scrapy_settings = {
         **default_settings,
         **user_settings,
         **spider.settings,
-        **internal_settings,  # last because these must not be overwritten
     }
 
-    scrapy_spider_cls = None
+    if spider.profile:
+        scrapy_settings['SCRATCHY_PROFILE'] = True
 
-    module = importlib.import_module(spider.module)
+    timeout = get_timeout(spider)
+    if timeout:
+        scrapy_settings['CLOSESPIDER_TIMEOUT'] = timeout  # closes gracefully, finish_reason is closespider_timeout
 
-    for cls in iter_spider_classes(module):
-        scrapy_spider_cls = cls
-        break  # use first valid class in module
+    internal_settings = {
+        'SCRATCHY_SPIDER_ID': spider.id,
+        'SCRATCHY_EXECUTION_ID': execution.id,
+        'ITEM_PIPELINES': {
+            **scrapy_settings.get('ITEM_PIPELINES', {}),
+            'scratchy.pipelines.ItemStoragePipeline': 1000,  # run after any user pipelines
+        },
+        'SPIDER_MIDDLEWARES': {
+            **scrapy_settings.get('SPIDER_MIDDLEWARES', {}),
+            'scratchy.middlewares.SeenRequestSpiderMiddleware': 940,  # records after the callback completed
+            'scratchy.profiling.CallbackTimingMiddleware': 950,  # closest to the spider
+        },
+        'DOWNLOADER_MIDDLEWARES': {
+            **scrapy_settings.get('DOWNLOADER_MIDDLEWARES', {}),
+            'scratchy.middlewares.SeenRequestMiddleware': 50,  # before the cache and the download
+        },
+        'EXTENSIONS': {
+            **scrapy_settings.get('EXTENSIONS', {}),
+            'scratchy.extensions.ExecutionProgress': 0,
+            'scratchy.extensions.ExecutionSampler': 0,
+            'scratchy.metrics.MetricsExtension': 0,
+            'scratchy.profiling.ProfileExtension': 0,
+        },
+    }
+
+    scrapy_settings.update(internal_settings)  # last because these must not be overwritten
 
-    if scrapy_spider_cls is None:
-        raise RuntimeError(f'No valid spider class found in module {module}')
+    return scrapy_settings
+
+
+class CrawlerLogFilter(logging.Filter):
+    """
+    Drops records that belong to other crawlers running in the same process.
+
+    Scrapy attaches the spider to most log records, records without one are kept.
+    The crawler is looked up on the run when filtering, because the handler is
+    attached before the crawler is created.
+    """
+
+    def __init__(self, run):
+        super().__init__()
+        self.run = run
+
+    def filter(self, record):
+        spider = getattr(record, 'spider', None)
+        return spider is None or getattr(spider, 'crawler', None) is self.run.crawler
+
+
+class ExecutionNotQueued(Exception):
+    pass
+
+
+def end_execution(execution, finish_reason, queued=False):
+    """
+    Ends an execution that could not run, unless it has ended already, or with
+    queued, unless it has started.
+    """
+    qs = Execution.objects.filter(pk=execution.pk, time_ended__isnull=True)
+    if queued:
+        qs = qs.filter(time_started__isnull=True)
+    execution.time_ended = now()
+    execution.stats = {**execution.stats, 'finish_reason': finish_reason}
+    updated = qs.update(
+        time_ended=execution.time_ended,
+        stats=execution.stats,
+    )
+    if updated:
+        execution.update_spider_counters()
+
+
+class SpiderRun:
+    """
+    A single crawl of a spider, recorded as an Execution with its own log and stats.
+    """
+
+    def __init__(self, spider, started=None, time_queued=None, execution=None):
+        self.spider = spider
+        self.started = started if started is not None else time.monotonic()
+        self.spider_cls = get_spider_class(spider.module)  # first, a broken module leaves no execution behind
+        if execution is None:
+            self.execution = Execution.objects.create(spider=spider, time_started=now(), time_queued=time_queued)
+        else:
+            self.execution = execution  # queued by queue_spider or the scheduler
+            self.execution.time_started = now()
+            # a redelivered task or the watchdog may have started or ended it in the meantime
+            claimed = Execution.objects.filter(pk=execution.pk, time_started__isnull=True, time_ended__isnull=True).update(
+                time_started=self.execution.time_started,
+            )
+            if not claimed:
+                raise ExecutionNotQueued(f'Execution {execution.pk} is no longer queued')
+        self.metrics = get_metrics()
+
+        if self.metrics is not None and self.execution.time_queued is not None:
+            wait = (self.execution.time_started - self.execution.time_queued).total_seconds()
+            self.metrics.queue_wait.labels(self.spider_cls.name).observe(wait)
+        self.crawler = None
+
+        scrapy_settings = Settings(get_scrapy_settings(spider, self.execution))
+        log_settings = scrapy_settings.copy()
+        self.spider_cls.update_settings(log_settings)  # custom_settings, as the crawler applies them
+
+        self.log_handler = ExecutionLogHandler(
+            self.execution.id,
+            head_lines=log_settings.getint('SCRATCHY_LOG_HEAD_LINES', 5000),
+            tail_lines=log_settings.getint('SCRATCHY_LOG_TAIL_LINES', 5000),
+            flush_interval=log_settings.getfloat('SCRATCHY_LOG_FLUSH_INTERVAL', 10.0),
+            level=spider.log_level,
+        )
+        self.log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        self.log_handler.addFilter(CrawlerLogFilter(self))
+        self.loggers = [
+            logging.getLogger('scrapy'),
+            logging.getLogger(self.spider_cls.name),  # scrapy uses the spider name as logger id
+        ]
+
+        # attach before creating the crawler, older scrapy versions log the overridden settings there
+        for log in self.loggers:
+            log.addHandler(self.log_handler)
+
+        try:
+            self.crawler = Crawler(self.spider_cls, scrapy_settings)
+        except Exception:
+            logger.exception(f'Could not create the crawler of spider {spider}')
+            self.remove_log_handler()
+            end_execution(self.execution, FAILED)
+            raise
+
+    def remove_log_handler(self):
+        for log in self.loggers:
+            log.removeHandler(self.log_handler)
+
+        self.log_handler.close()  # saves the log
+
+    def crawl(self, process):
+        """
+        Schedules the crawl on a CrawlerProcess or CrawlerRunner, returns the crawl deferred.
+        """
+        self.crawler.signals.connect(self.engine_started, signal=signals.engine_started)
+        d = process.crawl(self.crawler)
+        d.addBoth(self.finish)
+        return d
+
+    def engine_started(self):
+        # time from the start of the task until the crawl starts, including imports
+        self.crawler.stats.set_value('scratchy/startup_seconds', round(time.monotonic() - self.started, 3))
+
+    def finish(self, result):
+        self.remove_log_handler()
+
+        self.execution.time_ended = now()
+        self.execution.stats = self.crawler.stats._stats
+        # the watchdog may have ended the execution already
+        updated = Execution.objects.filter(pk=self.execution.pk, time_ended__isnull=True).update(
+            time_ended=self.execution.time_ended,
+            stats=self.execution.stats,
+        )
+        if not updated:
+            logger.warning(f'Execution {self.execution.id} was ended by the watchdog before it finished')
+            return result
+
+        self.execution.update_spider_counters()
+
+        if self.metrics is not None:
+            duration = (self.execution.time_ended - self.execution.time_started).total_seconds()
+            self.metrics.execution_duration.labels(self.spider_cls.name, self.execution.finish_reason or '').observe(duration)
+
+        return result
+
+
+@shared_task
+def run_spider(spider_id, execution_id=None):
+    """
+    Runs a spider, starting the queued execution execution_id when given.
+    """
+    started = time.monotonic()
+    spider = SpiderModel.objects.get(id=spider_id)
+
+    execution = None
+    if execution_id is not None:
+        execution = Execution.objects.defer('log_data').get(id=execution_id)
+
+    try:
+        run = SpiderRun(spider, started=started, execution=execution)
+    except ExecutionNotQueued:
+        logger.warning(f'Execution {execution_id} is no longer queued, not starting it')
+        return
+    except Exception:
+        if execution is not None:
+            # SpiderRun ends the executions it has started itself
+            end_execution(execution, FAILED, queued=True)
+        raise
 
     process = CrawlerProcess(settings=None, install_root_handler=False)
+    run.crawl(process)
+    process.start()
+    # blocks here
+
+
+@shared_task
+def run_spiders(spider_ids):
+    """
+    Runs several spiders concurrently in a single CrawlerProcess.
 
-    log_capture_string = StringIO()
-    log_handler = logging.StreamHandler(log_capture_string)
-    log_handler.setLevel(spider.log_level)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    log_handler.setFormatter(formatter)
-    scrapy_logger = logging.getLogger('scrapy')
-    scrapy_logger.addHandler(log_handler)
-    spider_logger = logging.getLogger(scrapy_spider_cls.name)  # scrapy uses the spider name as logger id
-    spider_logger.addHandler(log_handler)
+    Each spider gets its own Execution, stats and log. A spider that cannot be
+    loaded is logged and skipped so it does not prevent the others from running.
+    """
+    started = time.monotonic()
+    process = CrawlerProcess(settings=None, install_root_handler=False)
 
-    crawler = Crawler(scrapy_spider_cls, scrapy_settings)
+    for spider in SpiderModel.objects.filter(id__in=spider_ids):
+        try:
+            run = SpiderRun(spider, started=started)
+        except Exception:
+            logger.exception(f'Could not load spider {spider}')
+            continue
+        run.crawl(process)
 
-    process.crawl(crawler)
     process.start()
     # blocks here
 
-    log_contents = log_capture_string.getvalue()
-    spider_logger.removeHandler(log_handler)
-    scrapy_logger.removeHandler(log_handler)
-    log_capture_string.close()
 
-    execution.time_ended = now()
-    execution.stats = crawler.stats._stats
-    execution.log = log_contents
-    execution.save()
+@shared_task
+def maintain_item_partitions():
+    partitions.maintain()
 
-    item_storage.seek(0)
 
-    items = []
-    for line in item_storage.readlines():
-        item_data = json.loads(line)
-        item = Item(spider_id=spider_id, execution=execution, data=item_data)
-        items.append(item)
+@shared_task
+def purge(max_runtime=None):
+    Purge(max_runtime=max_runtime).run()
 
-    Item.objects.bulk_create(items, batch_size=100)
 
-    item_storage.close()
-    os.remove(item_storage.name)
+@shared_task
+def mark_abandoned_executions():
+    watchdog.mark_abandoned_executions()
+
+
+@shared_task
+def compact_metrics():
+    compact_files()
@@ -0,0 +1,199 @@
+"""
+Test scrapes of a single URL on a pool of warm subprocesses.
+
+A Twisted reactor can't be restarted, so every test scrape runs in a pool process
+that is replaced after one scrape. Pool processes are forked from a forkserver
+with Django and Scrapy preloaded, not from the threaded web server, and set up
+Django and import the spider modules in the background, so the next scrape
+starts without import overhead. A scrape is killed after
+SCRATCHY_TEST_SCRAPE_TIMEOUT seconds. Results are cached by spider, URL and code
+version.
+"""
+import hashlib
+import importlib.util
+import io
+import json
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+TEST_SETTINGS = {
+    'DNS_TIMEOUT': 5,
+    'DOWNLOAD_TIMEOUT': 5,
+    'AUTOTHROTTLE_ENABLED': True,
+    'AUTOTHROTTLE_START_DELAY': 1,
+    'AUTOTHROTTLE_MAX_DELAY': 5,
+    'AUTOTHROTTLE_TARGET_CONCURRENCY': 1.0,
+    'CLOSESPIDER_ITEMCOUNT': 1,
+    'CLOSESPIDER_PAGECOUNT': 3,
+    'TELNETCONSOLE_ENABLED': False,
+    'LOG_LEVEL': 'DEBUG',
+}
+
+# user components may save items, test scrapes run without them unless they are
+# added back with SCRATCHY_TEST_SCRAPE_SETTINGS; the HTTP cache is kept
+EXCLUDED_SETTINGS = (
+    'ITEM_PIPELINES',
+    'DOWNLOADER_MIDDLEWARES',
+    'SPIDER_MIDDLEWARES',
+    'EXTENSIONS',
+)
+
+PRELOAD = ['django', 'scrapy.crawler', 'scratchy.testscrape']
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_timeout():
+    return getattr(settings, 'SCRATCHY_TEST_SCRAPE_TIMEOUT', 30)
+
+
+def warm_up(modules):
+    """
+    Runs in each pool process before it accepts a scrape.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    django.setup()  # DJANGO_SETTINGS_MODULE is inherited from the web server
+    import scrapy.crawler  # noqa: F401
+
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            logger.exception(f'Could not import spider module {module}')
+
+
+def get_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            from .models import Spider
+
+            modules = list(Spider.objects.values_list('module', flat=True).distinct())
+            # forking the web server would copy the sockets and locks of its other threads
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(PRELOAD)
+            _pool = context.Pool(
+                processes=getattr(settings, 'SCRATCHY_TEST_SCRAPE_PROCESSES', 2),
+                initializer=warm_up,
+                initargs=(modules,),
+                maxtasksperchild=1,  # a reactor runs once per process
+            )
+        return _pool
+
+
+def get_code_version(module):
+    """
+    Returns a hash of the source of a spider module.
+    """
+    spec = importlib.util.find_spec(module)
+    if spec is None or not spec.origin:
+        return ''
+    with open(spec.origin, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def get_cache_key(spider, url, scrapy_settings):
+    version = hashlib.sha1(
+        json.dumps([get_code_version(spider.module), scrapy_settings], sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f'scratchy:test_scrape:{spider.id}:{hashlib.sha1(url.encode()).hexdigest()}:{version}'
+
+
+def get_test_settings(spider):
+    user_settings = {
+        **getattr(settings, 'SCRATCHY_SPIDERS', {}),
+        **spider.settings,
+    }
+    return {
+        **{k: v for k, v in user_settings.items() if k not in EXCLUDED_SETTINGS},
+        **TEST_SETTINGS,
+        **getattr(settings, 'SCRATCHY_TEST_SCRAPE_SETTINGS', {}),
+        'CLOSESPIDER_TIMEOUT': get_timeout(),
+        'SCRATCHY_SPIDER_ID': spider.id,  # for the database HTTP cache storage
+    }
+
+
+def scrape(module, scrapy_settings, url, timeout):
+    """
+    Runs in a pool process. Crawls url until one item is scraped and returns the
+    item, the URL of the response it was scraped from and the log.
+    """
+    from itemadapter import ItemAdapter
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+
+    from .tasks import get_spider_class
+
+    signal.alarm(int(timeout) + 5)  # hard limit in case the spider doesn't close
+
+    result = {'item': None, 'url': '', 'log': '', 'error': ''}
+
+    log = io.StringIO()
+    handler = logging.StreamHandler(log)
+    handler.setFormatter(logging.Formatter('%(asctime)s [%(name)s] %(levelname)s: %(message)s'))
+    logging.root.addHandler(handler)
+    logging.root.setLevel(logging.DEBUG)
+
+    def item_scraped(item, response, spider):
+        if result['item'] is None:
+            result['item'] = json.loads(json.dumps(ItemAdapter(item).asdict(), cls=DjangoJSONEncoder))
+            result['url'] = response.url
+
+    try:
+        process = CrawlerProcess(scrapy_settings, install_root_handler=False)
+        crawler = process.create_crawler(get_spider_class(module))
+        crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+        process.crawl(crawler, start_urls=[url])
+        process.start()
+    except Exception as e:
+        logger.exception('Test scrape failed')
+        result['error'] = str(e)
+
+    result['log'] = log.getvalue()
+    return result
+
+
+def run_test_scrape(spider, url, use_cache=True):
+    """
+    Returns a dict with the item, url, log, error, seconds and whether the result
+    was cached.
+    """
+    scrapy_settings = get_test_settings(spider)
+    key = get_cache_key(spider, url, scrapy_settings)
+
+    if use_cache:
+        result = cache.get(key)
+        if result is not None:
+            return {**result, 'cached': True}
+
+    timeout = get_timeout()
+    t = time.monotonic()
+    async_result = get_pool().apply_async(scrape, (spider.module, scrapy_settings, url, timeout))
+    try:
+        result = async_result.get(timeout=timeout + 10)
+    except multiprocessing.TimeoutError:
+        return {
+            'item': None,
+            'url': '',
+            'log': '',
+            'error': f'Test scrape did not finish within {timeout} seconds',
+            'seconds': round(time.monotonic() - t, 2),
+            'cached': False,
+        }
+
+    result['seconds'] = round(time.monotonic() - t, 2)
+    if not result['error']:
+        cache.set(key, result, getattr(settings, 'SCRATCHY_TEST_SCRAPE_CACHE_TIMEOUT', 3600))
+    return {**result, 'cached': False}
@@ -1,3 +1,22 @@
-from django.shortcuts import render
+from django.http import Http404, HttpResponse
 
-# Create your views here.
+from .metrics import get_metrics, get_multiproc_dir
+
+
+def metrics(request):
+    """
+    Prometheus metrics of all processes when PROMETHEUS_MULTIPROC_DIR is set,
+    otherwise of the web server process only.
+    """
+    if get_metrics() is None:
+        raise Http404('Metrics are not enabled')
+
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+
+    if get_multiproc_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,52 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .models import Execution
+
+logger = logging.getLogger(__name__)
+
+ABANDONED = 'abandoned'
+
+
+def mark_abandoned_executions(timeout=None, queued_timeout=None):
+    """
+    Ends executions whose worker has died, recognised by a heartbeat (or start time,
+    when there is no heartbeat) older than SCRATCHY_HEARTBEAT_TIMEOUT seconds, and
+    queued executions that did not start within SCRATCHY_QUEUED_TIMEOUT seconds,
+    for example because the task was lost.
+
+    The execution gets finish_reason 'abandoned', items saved before the worker died
+    are kept. Ending the execution frees its slot for the scheduler.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'SCRATCHY_HEARTBEAT_TIMEOUT', 300)
+    if queued_timeout is None:
+        queued_timeout = getattr(settings, 'SCRATCHY_QUEUED_TIMEOUT', 24 * 3600)
+    cutoff = now() - timedelta(seconds=timeout)
+    queued_cutoff = now() - timedelta(seconds=queued_timeout)
+
+    abandoned = Execution.objects.filter(time_ended__isnull=True).filter(
+        Q(time_heartbeat__lt=cutoff)
+        | Q(time_heartbeat__isnull=True, time_started__lt=cutoff)
+        | Q(time_started__isnull=True, time_queued__lt=queued_cutoff)
+    )
+
+    executions = []
+    for execution in abandoned.defer('log_data'):
+        execution.time_ended = now()
+        execution.stats = {**execution.stats, 'finish_reason': ABANDONED}
+        # the execution may have ended, started or sent a heartbeat in the meantime
+        updated = abandoned.filter(pk=execution.pk).update(
+            time_ended=execution.time_ended,
+            stats=execution.stats,
+        )
+        if updated:
+            execution.update_spider_counters()
+            logger.warning(f'Marked execution {execution.id} as abandoned')
+            executions.append(execution)
+
+    return executions
@@ -0,0 +1,97 @@
+import logging
+import traceback
+from collections import Counter
+
+from django.db import close_old_connections, transaction
+from django.utils.timezone import now
+from scrapy.crawler import CrawlerRunner
+from scrapy.utils.log import configure_logging
+from twisted.internet import reactor, task
+from twisted.python.failure import Failure
+
+from .models import CrawlRequest
+from .tasks import SpiderRun
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlWorker:
+    """
+    Runs spiders for pending CrawlRequests in a single, long-lived Twisted reactor.
+
+    The request table is polled every poll_interval seconds. At most concurrency
+    crawls run at the same time, and at most per_spider of them for the same spider.
+    Requests that cannot be started yet stay pending for the next poll. Limits
+    apply per worker process, several workers can poll the same table safely.
+    """
+
+    def __init__(self, concurrency=4, per_spider=1, poll_interval=2.0):
+        self.concurrency = concurrency
+        self.per_spider = per_spider
+        self.poll_interval = poll_interval
+        self.runner = CrawlerRunner()
+        self.running = Counter()  # spider_id -> number of running crawls
+
+    def run(self):
+        configure_logging({'LOG_LEVEL': 'INFO'})
+        loop = task.LoopingCall(self.poll)
+        loop.start(self.poll_interval).addErrback(self.poll_failed)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.runner.stop)
+        reactor.run()
+
+    def poll_failed(self, failure):
+        logger.error('Polling for crawl requests failed, stopping worker', exc_info=(failure.type, failure.value, failure.tb))
+        reactor.stop()
+
+    def poll(self):
+        close_old_connections()
+
+        available = self.concurrency - sum(self.running.values())
+        if available <= 0:
+            return
+
+        for request in self.claim(available):
+            try:
+                run = SpiderRun(request.spider, time_queued=request.time_created)
+            except Exception:
+                logger.exception(f'Could not load spider {request.spider}')
+                # stays claimed, retrying a broken spider on every poll would not help
+                CrawlRequest.objects.filter(pk=request.pk).update(error=traceback.format_exc())
+                continue
+
+            CrawlRequest.objects.filter(pk=request.pk).update(execution=run.execution)
+
+            self.running[request.spider_id] += 1
+            run.crawl(self.runner).addBoth(self.crawl_finished, request.spider_id)
+
+    def claim(self, limit):
+        claimed = []
+        running = self.running.copy()
+
+        with transaction.atomic():
+            pending = (
+                CrawlRequest.objects
+                .filter(time_claimed__isnull=True)
+                .select_related('spider')
+                .select_for_update(skip_locked=True, of=('self',))
+                .order_by('time_created')
+            )
+            for request in pending.iterator():
+                if running[request.spider_id] >= self.per_spider:
+                    continue
+                running[request.spider_id] += 1
+                claimed.append(request)
+                if len(claimed) >= limit:
+                    break
+
+            CrawlRequest.objects.filter(pk__in=[r.pk for r in claimed]).update(time_claimed=now())
+
+        return claimed
+
+    def crawl_finished(self, result, spider_id):
+        self.running[spider_id] -= 1
+        if self.running[spider_id] <= 0:
+            del self.running[spider_id]
+        if isinstance(result, Failure):
+            logger.error('Crawl failed', exc_info=(result.type, result.value, result.tb))
+        return None
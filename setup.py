@@ -9,6 +9,7 @@ setup(
     keywords='django scrapy celery',
     version='0.4.0',
     packages=find_packages(),
+    include_package_data=True,
     install_requires=[
         'django',
         'celery',
@@ -16,6 +17,10 @@ setup(
         'pandas',
         'openpyxl',
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+        'metrics': ['prometheus_client'],
+    },
     classifiers=[
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 3',
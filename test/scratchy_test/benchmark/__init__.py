@@ -0,0 +1,5 @@
+"""
+End-to-end benchmarks of scratchy against a synthetic site served by the test project.
+
+Run from the test directory with ``python -m scratchy_test.benchmark --help``.
+"""
@@ -0,0 +1,306 @@
+"""
+Runs the benchmark stages for each site size and writes the results as JSON.
+
+    cd test
+    python -m scratchy_test.benchmark --pages 1000 10000 100000 --item-size 2000 --depth 4
+
+Stages:
+
+- crawl: run_spider against the synthetic site, responses and items per second
+- ingest: save_items rows per second for each ingest method (rolled back)
+- dataframe: Execution.items_as_df
+- export: CSV, JSONL, Excel, SQLite and Parquet exports of the crawled items
+- admin: changelist response times of the spider, execution and item admin
+
+Everything created is deleted afterwards unless --keep is given.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'scratchy_test.settings')
+django.setup()
+
+import scrapy  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.servers.basehttp import ThreadedWSGIServer  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+from django.db import connection, connections, transaction  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.testcases import QuietWSGIRequestHandler  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.urls import reverse  # noqa: E402
+from django.utils.timezone import now  # noqa: E402
+
+from scratchy import exports  # noqa: E402
+from scratchy.ingest import METHODS, get_method, save_items  # noqa: E402
+from scratchy.models import Spider, Execution, Item  # noqa: E402
+from scratchy.purge import Purge  # noqa: E402
+from scratchy.tasks import run_spider  # noqa: E402
+
+from .site import make_data  # noqa: E402
+
+STAGES = ['crawl', 'ingest', 'dataframe', 'export', 'admin']
+
+SPIDER_MODULE = 'scratchy_test.benchmark.spider'
+
+
+def serve(port):
+    server = ThreadedWSGIServer(('localhost', port), QuietWSGIRequestHandler, allow_reuse_address=True)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def timed(f, *args, **kwargs):
+    t = time.perf_counter()
+    result = f(*args, **kwargs)
+    return time.perf_counter() - t, result
+
+
+def get_environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'scrapy': scrapy.__version__,
+        'database': f'{connection.vendor} {connection.pg_version if connection.vendor == "postgresql" else ""}'.strip(),
+        'commit': commit,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+class Benchmark:
+
+    def __init__(self, pages, item_size, depth, port, repeat, concurrency):
+        self.pages = pages
+        self.item_size = item_size
+        self.depth = depth
+        self.port = port
+        self.repeat = repeat
+        self.concurrency = concurrency
+        self.spider = None
+        self.execution = None
+
+    def result(self, stage, seconds, rows=None, **extra):
+        result = {
+            'stage': stage,
+            'pages': self.pages,
+            'item_size': self.item_size,
+            'depth': self.depth,
+            'seconds': round(seconds, 4),
+            **extra,
+        }
+        if rows is not None:
+            result['rows'] = rows
+            result['rows_per_second'] = round(rows / seconds) if seconds else None
+        print(json.dumps(result), file=sys.stderr)
+        return result
+
+    def setup(self):
+        start_url = f'http://localhost:{self.port}{reverse("bench_list", args=[self.pages, self.item_size, self.depth, 0])}'
+        self.spider, _ = Spider.objects.update_or_create(
+            module=SPIDER_MODULE,
+            defaults=dict(
+                name='benchmark',
+                settings={
+                    'BENCHMARK_START_URL': start_url,
+                    'AUTOTHROTTLE_ENABLED': False,
+                    'CONCURRENT_REQUESTS': self.concurrency,
+                    'CONCURRENT_REQUESTS_PER_DOMAIN': self.concurrency,
+                    'ROBOTSTXT_OBEY': False,
+                    'HTTPCACHE_ENABLED': False,
+                    'LOG_LEVEL': 'INFO',
+                },
+            ),
+        )
+
+    def get_execution(self):
+        """
+        Returns the execution of the crawl stage, or saves generated items to a new
+        execution when the crawl stage was skipped.
+        """
+        if self.execution is None:
+            self.execution = Execution.objects.create(spider=self.spider, time_started=now(), time_ended=now())
+            for start in range(0, self.pages, 1000):
+                save_items([
+                    Item(spider=self.spider, execution=self.execution, data=make_data(n, self.item_size, self.depth))
+                    for n in range(start, min(start + 1000, self.pages))
+                ])
+            self.execution.item_count = self.pages
+            self.execution.save(update_fields=['item_count'])
+        return self.execution
+
+    def crawl(self):
+        connections.close_all()  # the crawl runs in a forked process, which must not share the connection
+        process = multiprocessing.get_context('fork').Process(target=run_spider, args=(self.spider.id,))
+        t = time.perf_counter()
+        process.start()
+        process.join()
+        seconds = time.perf_counter() - t
+
+        self.execution = Execution.objects.filter(spider=self.spider).latest('time_started')
+        stats = self.execution.stats
+        elapsed = stats.get('elapsed_time_seconds') or seconds
+        responses = stats.get('response_received_count', 0)
+        return [self.result(
+            'crawl',
+            seconds,
+            rows=self.execution.item_count,
+            finish_reason=self.execution.finish_reason,
+            responses=responses,
+            responses_per_second=round(responses / elapsed) if elapsed else None,
+            crawl_seconds=elapsed,
+            startup_seconds=stats.get('scratchy/startup_seconds'),
+        )]
+
+    def ingest(self, batch_size=100):
+        results = []
+        for method in METHODS:
+            if get_method(method) != method:
+                continue
+            seconds = 0.0
+            with transaction.atomic():
+                execution = Execution.objects.create(spider=self.spider, time_started=now())
+                for start in range(0, self.pages, batch_size):
+                    items = [
+                        Item(spider=self.spider, execution=execution, data=make_data(n, self.item_size, self.depth))
+                        for n in range(start, min(start + batch_size, self.pages))
+                    ]
+                    elapsed, _ = timed(save_items, items, method=method)
+                    seconds += elapsed
+                transaction.set_rollback(True)
+            results.append(self.result('ingest', seconds, rows=self.pages, method=method, batch_size=batch_size))
+        return results
+
+    def dataframe(self):
+        execution = self.get_execution()
+        try:
+            seconds, df = timed(execution.items_as_df)
+        except ImportError:
+            return []
+        return [self.result('dataframe', seconds, rows=len(df))]
+
+    def export(self):
+        execution = self.get_execution()
+        results = []
+
+        def consume(chunks):
+            return sum(len(chunk) for chunk in chunks)
+
+        for name, f in [('csv', exports.iter_csv), ('jsonl', exports.iter_jsonl)]:
+            seconds, size = timed(consume, f(execution))
+            results.append(self.result('export', seconds, rows=execution.item_count, format=name, bytes=size))
+
+        files = [
+            ('excel', '.xlsx', lambda path: exports.write_xlsx(execution, path)),
+            ('sqlite', '.sqlite3', lambda path: exports.write_sqlite(execution, path)),
+            ('parquet', '.parquet', lambda path: exports.write_parquet(execution, path)),
+        ]
+        for name, suffix, write in files:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, f'export{suffix}')
+                try:
+                    seconds, _ = timed(write, path)
+                except ImportError:
+                    continue  # optional dependency not installed
+                results.append(self.result('export', seconds, rows=execution.item_count, format=name, bytes=os.path.getsize(path)))
+
+        return results
+
+    def admin(self):
+        execution = self.get_execution()
+        User.objects.filter(username='scratchy-benchmark').delete()  # left over from an interrupted run
+        user = User.objects.create_superuser('scratchy-benchmark', 'benchmark@example.com', None)
+        client = Client()
+        client.force_login(user)
+        results = []
+
+        urls = [
+            ('spider', reverse('admin:scratchy_spider_changelist')),
+            ('execution', reverse('admin:scratchy_execution_changelist')),
+            ('execution_filtered', reverse('admin:scratchy_execution_changelist') + f'?spider__id__exact={self.spider.id}'),
+            ('item', reverse('admin:scratchy_item_changelist')),
+            ('item_filtered', reverse('admin:scratchy_item_changelist') + f'?spider__id__exact={self.spider.id}'),
+            ('execution_change', reverse('admin:scratchy_execution_change', args=[execution.id])),
+        ]
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                for name, url in urls:
+                    timings = []
+                    for _ in range(self.repeat):
+                        with CaptureQueriesContext(connection) as queries:
+                            seconds, response = timed(client.get, url)
+                        timings.append(seconds)
+                    results.append(self.result(
+                        'admin',
+                        statistics.median(timings),
+                        page=name,
+                        status=response.status_code,
+                        queries=len(queries),
+                        max_seconds=round(max(timings), 4),
+                    ))
+        finally:
+            user.delete()
+        return results
+
+    def cleanup(self):
+        Purge(sleep=0, report=lambda message: None).delete_spider(self.spider)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m scratchy_test.benchmark', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, nargs='+', default=[1000], help='Sizes of the synthetic site, up to 1000000.')
+    parser.add_argument('--item-size', type=int, default=500, help='Bytes of text per item.')
+    parser.add_argument('--depth', type=int, default=2, help='Levels of nesting per item.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--port', type=int, default=9009)
+    parser.add_argument('--repeat', type=int, default=5, help='Requests per admin page.')
+    parser.add_argument('--concurrency', type=int, default=32, help='CONCURRENT_REQUESTS of the crawl.')
+    parser.add_argument('--output', default=f'benchmark-{datetime.now():%Y%m%d-%H%M%S}.json')
+    parser.add_argument('--keep', action='store_true', help='Keep the spider, executions and items.')
+    options = parser.parse_args()
+
+    server = serve(options.port)
+    report = {
+        'started': now().isoformat(),
+        'environment': get_environment(),
+        'options': {k: v for k, v in vars(options).items() if k != 'output'},
+        'results': [],
+    }
+
+    try:
+        for pages in options.pages:
+            benchmark = Benchmark(pages, options.item_size, options.depth, options.port, options.repeat, options.concurrency)
+            benchmark.setup()
+            try:
+                for stage in options.stages:
+                    report['results'].extend(getattr(benchmark, stage)())
+            finally:
+                if not options.keep:
+                    benchmark.cleanup()
+    finally:
+        server.shutdown()
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {options.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
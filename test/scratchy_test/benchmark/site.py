@@ -0,0 +1,59 @@
+"""
+A synthetic site of any number of pages, generated from the URL.
+
+/bench/<pages>/<size>/<depth>/list/<page>/ links to PAGE_SIZE item pages and the
+next list page, /bench/<pages>/<size>/<depth>/item/<id>/ holds an item of about
+size bytes with depth levels of nesting as JSON.
+"""
+import json
+
+from django.http import Http404, HttpResponse
+from django.urls import path, reverse
+
+PAGE_SIZE = 100
+
+FILLER = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. '
+
+
+def make_data(n, size=500, depth=2):
+    data = {
+        'id': n,
+        'title': f'Item {n}',
+        'price': round(n * 1.5, 2),
+        'tags': ['a', 'b', 'c'],
+        'content': (FILLER * (size // len(FILLER) + 1))[:size],
+    }
+    nested = data
+    for level in range(depth):
+        nested['child'] = {'level': level + 1, 'values': [n, level]}
+        nested = nested['child']
+    return data
+
+
+def list_page(request, pages, size, depth, page):
+    first = page * PAGE_SIZE
+    if first >= pages:
+        raise Http404
+    links = [
+        f'<li><a class="item" href="{reverse("bench_item", args=[pages, size, depth, n])}">{n}</a></li>'
+        for n in range(first, min(first + PAGE_SIZE, pages))
+    ]
+    if first + PAGE_SIZE < pages:
+        links.append(f'<li><a class="next" href="{reverse("bench_list", args=[pages, size, depth, page + 1])}">Next</a></li>')
+    return HttpResponse(f'<!DOCTYPE html><html><body><ul>{"".join(links)}</ul></body></html>')
+
+
+def item_page(request, pages, size, depth, n):
+    if n >= pages:
+        raise Http404
+    data = json.dumps(make_data(n, size, depth))
+    return HttpResponse(
+        f'<!DOCTYPE html><html><body><h1>Item {n}</h1>'
+        f'<script type="application/json" id="data">{data}</script></body></html>'
+    )
+
+
+urlpatterns = [
+    path('<int:pages>/<int:size>/<int:depth>/list/<int:page>/', list_page, name='bench_list'),
+    path('<int:pages>/<int:size>/<int:depth>/item/<int:n>/', item_page, name='bench_item'),
+]
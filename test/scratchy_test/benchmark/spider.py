@@ -0,0 +1,24 @@
+import json
+
+from scrapy import Request, Spider
+
+
+class BenchmarkSpider(Spider):
+    """
+    Crawls the synthetic site starting at the BENCHMARK_START_URL setting.
+    """
+    name = 'benchmark'
+
+    def start_requests(self):
+        yield Request(self.settings.get('BENCHMARK_START_URL'))
+
+    def parse(self, response):
+        for href in response.css('a.item::attr(href)').getall():
+            yield response.follow(href, callback=self.parse_item)
+
+        next_page = response.css('a.next::attr(href)').get()
+        if next_page:
+            yield response.follow(next_page)
+
+    def parse_item(self, response):
+        yield json.loads(response.css('#data::text').get())
@@ -1,7 +1,36 @@
-from django.test import LiveServerTestCase, override_settings
+import csv
+import importlib.util
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-from scratchy.models import Spider, Execution, Item
-from scratchy.tasks import run_spider
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils.timezone import now
+from scrapy import Request
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+
+from scratchy import partitions
+from scratchy.exports import get_arrow_schema, iter_csv, write_sqlite
+from scratchy.ingest import COPY, DEDUP_UPDATE, canonical_json, get_data_hash, save_items
+from scratchy.log import ExecutionLogHandler
+from scratchy.middlewares import SeenRequestMiddleware, SeenRequestSpiderMiddleware
+from scratchy.purge import Purge
+from scratchy.scheduling import schedule_due_spiders
+from scratchy.models import Spider, Execution, Item, SeenRequest
+from scratchy.pipelines import ItemStoragePipeline
+from scratchy.tasks import run_spider, run_spiders
+from scratchy.watchdog import mark_abandoned_executions
 
 CUSTOM_USER_AGENT = 'scratchy-user-agent'
 user_settings = {
@@ -9,6 +38,17 @@ user_settings = {
 }
 
 
+def run_in_process(task, *args):
+    """
+    Runs a crawl task in a forked process, a Twisted reactor can't be restarted.
+    """
+    connections.close_all()  # the forked process must not share the connection
+    process = multiprocessing.get_context('fork').Process(target=task, args=args)
+    process.start()
+    process.join()
+    return process.exitcode
+
+
 @override_settings(SCRATCHY_SPIDERS=user_settings)
 class TestSimpleScraping(LiveServerTestCase):
     port = 9009
@@ -18,13 +58,616 @@ class TestSimpleScraping(LiveServerTestCase):
 
     def test_spider_execution_saves_items(self):
 
-        run_spider(self.spider.id)
+        self.assertEqual(run_in_process(run_spider, self.spider.id), 0)
         execution = Execution.objects.first()
         self.assertEqual(execution.spider_id, self.spider.id)
         self.assertEqual(execution.finish_reason, 'finished')
 
         num_items = Item.objects.all().count()
         self.assertEqual(num_items, 3)
+        self.assertEqual(Item.objects.filter(execution=execution).count(), 3)
 
         # test user settings
         self.assertIn(CUSTOM_USER_AGENT, execution.log)
+
+    def test_batch_execution_saves_items(self):
+
+        self.assertEqual(run_in_process(run_spiders, [self.spider.id]), 0)
+        execution = Execution.objects.get(spider=self.spider)
+        self.assertEqual(execution.finish_reason, 'finished')
+        self.assertEqual(Item.objects.filter(execution=execution).count(), 3)
+
+
+class TestDedup(TestCase):
+
+    def setUp(self):
+        self.spider = Spider.objects.create(module='scratchy_test.spider')
+
+    def save(self, execution, data, fields=None):
+        items = [
+            Item(spider=self.spider, execution=execution, data=d, data_hash=get_data_hash(d, fields))
+            for d in data
+        ]
+        counts = save_items(items, dedup=DEDUP_UPDATE)
+        Execution.objects.filter(pk=execution.pk).update(item_count=counts['new'] + counts['updated'])
+        return counts
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            ItemStoragePipeline.from_crawler(get_crawler(settings_dict={'SCRATCHY_ITEM_DEDUP': 'replace'}))
+
+    def test_canonical_json(self):
+        self.assertEqual(canonical_json({'b': [1, {'d': 1, 'c': 2}], 'a': None}), '{"a":null,"b":[1,{"c":2,"d":1}]}')
+
+    def test_get_data_hash(self):
+        self.assertEqual(get_data_hash({'a': 1, 'b': 2}), get_data_hash({'b': 2, 'a': 1}))
+        self.assertNotEqual(get_data_hash({'a': 1, 'b': 2}), get_data_hash({'a': 1, 'b': 3}))
+        self.assertEqual(get_data_hash({'a': 1, 'b': 2}, ['a']), get_data_hash({'a': 1, 'b': 3}, ['a']))
+        self.assertEqual(get_data_hash({'b': 2}, ['a']), get_data_hash({'a': None}, ['a']))
+
+    def test_update_moves_counts(self):
+        first = Execution.objects.create(spider=self.spider, time_started=now())
+        second = Execution.objects.create(spider=self.spider, time_started=now())
+
+        counts = self.save(first, [{'id': 1, 'v': 1}, {'id': 2, 'v': 1}], fields=['id'])
+        self.assertEqual(counts, {'new': 2, 'updated': 0, 'unchanged': 0})
+
+        counts = self.save(second, [{'id': 1, 'v': 2}, {'id': 2, 'v': 1}, {'id': 3, 'v': 1}], fields=['id'])
+        self.assertEqual(counts, {'new': 1, 'updated': 1, 'unchanged': 1})
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.item_count, Item.objects.filter(execution=first).count())
+        self.assertEqual(second.item_count, Item.objects.filter(execution=second).count())
+        self.assertEqual((first.item_count, second.item_count), (1, 2))
+
+    def test_conflicts_are_not_counted_as_new(self):
+        other = Execution.objects.create(spider=self.spider, time_started=now())
+        execution = Execution.objects.create(spider=self.spider, time_started=now())
+        bulk_create = Item.objects.bulk_create
+
+        def concurrent_bulk_create(items, **kwargs):
+            # another execution saves the same item after the lookup of existing hashes
+            Item.objects.create(spider=self.spider, execution=other, data={'id': 1}, data_hash=get_data_hash({'id': 1}))
+            return bulk_create(items, **kwargs)
+
+        with mock.patch.object(Item.objects, 'bulk_create', concurrent_bulk_create):
+            counts = self.save(execution, [{'id': 1}, {'id': 2}])
+
+        self.assertEqual(counts, {'new': 1, 'updated': 0, 'unchanged': 1})
+        self.assertEqual(Item.objects.filter(execution=execution).count(), 1)
+
+
+class TestExports(TestCase):
+
+    def setUp(self):
+        spider = Spider.objects.create(module='scratchy_test.spider')
+        self.execution = Execution.objects.create(spider=spider, time_started=now())
+        self.data = [
+            {'name': 'a', 'Name': 'A', 'tags': ['x', 'y'], 'price': {'amount': 1.5, 'currency': 'EUR'}},
+            {'name': 'b', 'time_created': 'yesterday', 'tags': []},
+        ]
+        Item.objects.bulk_create([Item(spider=spider, execution=self.execution, data=d) for d in self.data])
+
+    def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.sqlite3')
+            write_sqlite(self.execution, path)
+            conn = sqlite3.connect(path)
+            conn.row_factory = sqlite3.Row
+            try:
+                rows = [dict(row) for row in conn.execute('SELECT * FROM items ORDER BY rowid')]
+            finally:
+                conn.close()
+
+        columns = list(rows[0])
+        self.assertEqual(len({c.lower() for c in columns}), 6)
+        self.assertEqual(columns[-1], 'time_created')
+        # the order of name and Name depends on the database collation
+        self.assertEqual({rows[0][c] for c in columns if c.lower().startswith('name')}, {'a', 'A'})
+        self.assertEqual(json.loads(rows[0]['tags']), ['x', 'y'])
+        self.assertEqual(json.loads(rows[0]['price']), {'amount': 1.5, 'currency': 'EUR'})
+        self.assertEqual(rows[1]['time_created_2'], 'yesterday')
+        self.assertNotEqual(rows[1]['time_created'], 'yesterday')
+        self.assertEqual(json.loads(rows[1]['tags']), [])
+
+    def test_csv(self):
+        rows = list(csv.DictReader(''.join(iter_csv(self.execution)).splitlines()))
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual({rows[0][c] for c in rows[0] if c.lower().startswith('name')}, {'a', 'A'})
+        self.assertEqual(json.loads(rows[0]['price']), {'amount': 1.5, 'currency': 'EUR'})
+        self.assertEqual(rows[1]['time_created_2'], 'yesterday')
+
+
+class TestClaimBatch(TransactionTestCase):
+
+    def setUp(self):
+        self.spider = Spider.objects.create(module='scratchy_test.spider')
+        Item.objects.bulk_create([Item(spider=self.spider, data={'n': n}) for n in range(100)])
+
+    def test_concurrent_consumers(self):
+        barrier = threading.Barrier(2)
+        batches = []
+
+        def consume():
+            try:
+                barrier.wait()
+                for batch in Item.objects.iter_claimed_batches(spider=self.spider, size=7):
+                    batches.append([item.id for item in batch])
+            finally:
+                connection.close()  # each thread has its own connection
+
+        threads = [threading.Thread(target=consume) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        ids = [pk for batch in batches for pk in batch]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(set(ids), set(Item.objects.values_list('id', flat=True)))
+        self.assertFalse(Item.objects.filter(processed=False).exists())
+
+    def test_expired_lease(self):
+        batch = Item.objects.claim_batch(spider=self.spider, size=10, lease=timedelta(seconds=-1))
+        again = Item.objects.claim_batch(spider=self.spider, size=10)
+        self.assertEqual([item.id for item in again], [item.id for item in batch])
+
+        others = Item.objects.claim_batch(spider=self.spider, size=10)
+        self.assertFalse({item.id for item in others} & {item.id for item in batch})
+
+    def test_acknowledged_items_are_not_claimed(self):
+        batch = Item.objects.claim_batch(spider=self.spider, size=10, lease=timedelta(seconds=-1))
+        Item.objects.filter(id__in=[item.id for item in batch]).mark_processed()
+
+        claimed = Item.objects.claim_batch(spider=self.spider, size=100)
+        self.assertEqual(len(claimed), 90)
+        self.assertFalse({item.id for item in claimed} & {item.id for item in batch})
+
+
+class TestExecutionLogHandler(TestCase):
+
+    def test_head_and_tail_are_kept(self):
+        spider = Spider.objects.create(module='scratchy_test.spider')
+        execution = Execution.objects.create(spider=spider, time_started=now())
+        handler = ExecutionLogHandler(execution.id, head_lines=3, tail_lines=2, flush_interval=0)
+        log = logging.getLogger('scratchy_test.log')
+        log.addHandler(handler)
+        log.propagate = False
+        try:
+            for n in range(10):
+                log.warning(f'record {n}')
+        finally:
+            log.removeHandler(handler)
+            log.propagate = True
+            handler.close()
+
+        execution.refresh_from_db()
+        self.assertEqual(execution.log.splitlines(), [
+            'record 0',
+            'record 1',
+            'record 2',
+            '[... 5 log records omitted ...]',
+            'record 8',
+            'record 9',
+        ])
+
+
+class TestPurge(TestCase):
+
+    def setUp(self):
+        self.spider = Spider.objects.create(module='scratchy_test.spider', item_retention_days=1, execution_retention_days=1)
+        self.execution = Execution.objects.create(spider=self.spider, time_started=now(), time_ended=now())
+        self.execution.update_spider_counters()
+        Item.objects.bulk_create([
+            Item(spider=self.spider, execution=self.execution, data={'n': n}, processed=n < 5) for n in range(8)
+        ])
+        Execution.objects.filter(pk=self.execution.pk).update(item_count=8)
+        Item.objects.update(time_created=now() - timedelta(days=2))
+        self.reports = []
+
+    def purge(self, **kwargs):
+        return Purge(sleep=0, report=self.reports.append, **kwargs)
+
+    def test_processed_items_are_deleted_in_batches(self):
+        deleted = self.purge(batch_size=2).delete(
+            Item.objects.filter(spider=self.spider, processed=True), 'processed items',
+        )
+
+        self.assertEqual(deleted, 5)
+        self.assertEqual(len(self.reports), 3)
+        self.assertEqual(Item.objects.count(), 3)
+        self.assertFalse(Item.objects.filter(processed=True).exists())
+        self.execution.refresh_from_db()
+        self.assertEqual(self.execution.item_count, 3)
+
+    def test_max_runtime(self):
+        self.assertEqual(self.purge(max_runtime=0).run(), 0)
+        self.assertEqual(Item.objects.count(), 8)
+
+    def test_delete_executions_keeps_items(self):
+        Execution.objects.filter(pk=self.execution.pk).update(time_started=now() - timedelta(days=2))
+
+        deleted = self.purge(batch_size=3).delete_executions(Execution.objects.filter(spider=self.spider), 'executions')
+
+        self.assertEqual(deleted, 1)
+        self.assertFalse(Execution.objects.exists())
+        self.assertEqual(Item.objects.filter(execution__isnull=True).count(), 8)
+        self.spider.refresh_from_db()
+        self.assertEqual(self.spider.execution_count, 0)
+
+    def test_run(self):
+        Execution.objects.filter(pk=self.execution.pk).update(time_started=now() - timedelta(days=2))
+
+        self.purge(batch_size=2).run()
+
+        self.assertEqual(Item.objects.count(), 3)
+        self.assertFalse(Execution.objects.exists())
+        self.spider.refresh_from_db()
+        self.assertEqual(self.spider.execution_count, 0)
+
+    def test_delete_spider_requires_ids(self):
+        with self.assertRaises(CommandError):
+            call_command('purge_scratchy', '--delete-spider')
+        self.assertTrue(Spider.objects.filter(pk=self.spider.pk).exists())
+
+
+class TestPartitions(TestCase):
+    """
+    Runs the partition SQL against a table shaped like the item table, the test
+    transaction rolls the DDL back.
+    """
+    table = 'scratchy_test_item'
+
+    def setUp(self):
+        patcher = mock.patch.object(partitions, 'TABLE', self.table)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.spider = Spider.objects.create(module='scratchy_test.spider')
+        self.execution = Execution.objects.create(spider=self.spider, time_started=now(), item_count=3)
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')  # pending trigger events prevent ALTER TABLE
+            cursor.execute(
+                f'CREATE TABLE {self.table} ('
+                f'id serial PRIMARY KEY, '
+                f'time_created timestamp with time zone NOT NULL, '
+                f'execution_id integer NULL REFERENCES scratchy_execution (id), '
+                f'processed boolean NOT NULL DEFAULT false, '
+                f"data jsonb NOT NULL DEFAULT '{{}}')"
+            )
+            cursor.execute(f'CREATE INDEX {self.table}_time_created ON {self.table} (time_created)')
+            cursor.execute(f'CREATE UNIQUE INDEX {self.table}_execution_data ON {self.table} (execution_id, data)')
+
+    def insert(self, time_created, processed=False):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.table} (time_created, execution_id, processed, data) VALUES (%s, %s, %s, %s) '
+                f'RETURNING tableoid::regclass::text',
+                [time_created, self.execution.id, processed, json.dumps({'t': time_created.isoformat()})],
+            )
+            return cursor.fetchone()[0]
+
+    def get_partitions(self):
+        with connection.cursor() as cursor:
+            return dict(partitions.get_partitions(cursor))
+
+    def test_convert(self):
+        self.insert(now() - timedelta(days=10))
+        self.insert(now())
+
+        partitions.convert(partitions.DAY)
+
+        with connection.cursor() as cursor:
+            self.assertTrue(partitions.is_partitioned(cursor))
+            cursor.execute(f'SELECT count(*) FROM {self.table}')
+            self.assertEqual(cursor.fetchone()[0], 2)
+            cursor.execute('SELECT count(*) FROM pg_constraint WHERE conname = %s', [f'{self.table}_partition_bound'])
+            self.assertEqual(cursor.fetchone()[0], 0)
+        existing = self.get_partitions()
+        self.assertEqual(existing[f'{self.table}_legacy'], partitions.next_period(partitions.period_start(now(), 'day'), 'day'))
+        self.assertIsNone(existing[f'{self.table}_default'])
+        self.assertEqual(len(existing), 5)  # legacy, default and 3 ahead
+        tomorrow = now() + timedelta(days=1)
+        self.assertEqual(self.insert(tomorrow), partitions.partition_name(partitions.period_start(tomorrow, 'day'), 'day'))
+
+    def test_create_partitions_with_rows_in_default(self):
+        partitions.convert(partitions.DAY)
+        later = now() + timedelta(days=10)
+        self.assertEqual(self.insert(later), f'{self.table}_default')
+
+        with self.assertLogs('scratchy.partitions', 'ERROR'):
+            created = partitions.create_partitions(partitions.DAY, ahead=12)
+
+        self.assertEqual(len(created), 6)  # up to the period of the row in the default partition
+        self.assertNotIn(partitions.partition_name(partitions.period_start(later, 'day'), 'day'), self.get_partitions())
+
+    def test_drop_expired_partitions(self):
+        past = now() - timedelta(days=30)
+        with mock.patch.object(partitions, 'now', return_value=past):
+            partitions.convert(partitions.DAY)
+        boundary = partitions.next_period(partitions.period_start(past, 'day'), 'day')
+        self.assertEqual(self.insert(past - timedelta(hours=1), processed=True), f'{self.table}_legacy')
+        self.insert(past - timedelta(hours=2), processed=True)
+        unprocessed = self.insert(boundary + timedelta(hours=1))
+
+        with self.assertLogs('scratchy.partitions', 'WARNING'):
+            removed = partitions.drop_expired_partitions(10)
+
+        self.assertIn(f'{self.table}_legacy', removed)
+        self.assertNotIn(unprocessed, removed)
+        self.assertEqual(set(self.get_partitions()), {unprocessed, f'{self.table}_default'})
+        self.execution.refresh_from_db()
+        self.assertEqual(self.execution.item_count, 1)
+
+        self.assertEqual(partitions.drop_expired_partitions(10, unprocessed=True), [unprocessed])
+        self.execution.refresh_from_db()
+        self.assertEqual(self.execution.item_count, 0)
+
+
+class TestScheduling(TestCase):
+
+    def create_spider(self, **kwargs):
+        return Spider.objects.create(module='scratchy_test.spider', active=True, **kwargs)
+
+    def test_due_spiders_are_queued(self):
+        due = self.create_spider(schedule_interval=timedelta(hours=1))
+        self.create_spider(schedule_interval=timedelta(hours=1), next_run_at=now() + timedelta(minutes=5))
+        self.create_spider(schedule_interval=timedelta(hours=1), active=False)
+        self.create_spider()  # no schedule
+
+        executions = schedule_due_spiders()
+
+        self.assertEqual([execution.spider_id for execution in executions], [due.id])
+        self.assertTrue(executions[0].is_queued)
+        due.refresh_from_db()
+        self.assertEqual(due.next_run_at, executions[0].time_queued + timedelta(hours=1))
+
+    def test_running_spiders_are_skipped(self):
+        spider = self.create_spider(schedule_interval=timedelta(hours=1))
+        Execution.objects.create(spider=spider, time_queued=now())
+
+        self.assertEqual(schedule_due_spiders(), [])
+        spider.refresh_from_db()
+        self.assertIsNone(spider.next_run_at)  # stays due
+
+    @override_settings(SCRATCHY_MAX_CONCURRENT_EXECUTIONS=2)
+    def test_max_concurrent_executions(self):
+        running = self.create_spider()
+        Execution.objects.create(spider=running, time_started=now())
+        for _ in range(3):
+            self.create_spider(schedule_interval=timedelta(hours=1))
+
+        self.assertEqual(len(schedule_due_spiders()), 1)
+        self.assertEqual(schedule_due_spiders(), [])  # the queued execution counts as running
+
+    @override_settings(SCRATCHY_MAX_CONCURRENT_EXECUTIONS_PER_DOMAIN=1)
+    def test_max_concurrent_executions_per_domain(self):
+        for domain in ['example.com', 'example.com', 'example.org']:
+            self.create_spider(schedule_interval=timedelta(hours=1), domain=domain)
+
+        executions = schedule_due_spiders()
+
+        self.assertEqual(sorted(execution.spider.domain for execution in executions), ['example.com', 'example.org'])
+
+    def test_cron(self):
+        spider = self.create_spider(schedule_cron='30 * * * *')
+
+        executions = schedule_due_spiders()
+
+        spider.refresh_from_db()
+        self.assertEqual(spider.next_run_at.minute, 30)
+        self.assertGreater(spider.next_run_at, executions[0].time_queued)
+        self.assertLessEqual(spider.next_run_at - executions[0].time_queued, timedelta(hours=1))
+
+    def test_run_spider_starts_queued_executions_once(self):
+        spider = self.create_spider()
+        started = Execution.objects.create(spider=spider, time_queued=now(), time_started=now())
+        ended = Execution.objects.create(spider=spider, time_queued=now(), time_ended=now())
+
+        # returns before a crawler is created
+        run_spider(spider.id, execution_id=started.id)
+        run_spider(spider.id, execution_id=ended.id)
+
+        ended.refresh_from_db()
+        self.assertIsNone(ended.time_started)
+        self.assertEqual(Execution.objects.filter(spider=spider).count(), 2)
+
+
+class TestWatchdog(TestCase):
+
+    def setUp(self):
+        self.spider = Spider.objects.create(module='scratchy_test.spider')
+
+    def create_execution(self, **kwargs):
+        return Execution.objects.create(spider=self.spider, **kwargs)
+
+    def test_abandoned_executions_are_ended(self):
+        old = now() - timedelta(hours=1)
+        silent = self.create_execution(time_started=old, time_heartbeat=old)
+        no_heartbeat = self.create_execution(time_started=old)
+        alive = self.create_execution(time_started=old, time_heartbeat=now())
+        starting = self.create_execution(time_started=now())
+        lost = self.create_execution(time_queued=now() - timedelta(days=2))
+        waiting = self.create_execution(time_queued=old)
+        ended = self.create_execution(time_started=old, time_ended=old)
+
+        abandoned = mark_abandoned_executions(timeout=300, queued_timeout=24 * 3600)
+
+        self.assertEqual({execution.id for execution in abandoned}, {silent.id, no_heartbeat.id, lost.id})
+        for execution in [silent, no_heartbeat, lost]:
+            execution.refresh_from_db()
+            self.assertEqual(execution.finish_reason, 'abandoned')
+        for execution in [alive, starting, waiting]:
+            execution.refresh_from_db()
+            self.assertIsNone(execution.time_ended)
+        ended.refresh_from_db()
+        self.assertEqual(ended.time_ended, old)
+        self.spider.refresh_from_db()
+        self.assertEqual(self.spider.execution_count, 3)
+
+
+def parse_detail(response):
+    pass
+
+
+def parse_list(response):
+    pass
+
+
+class TestSeenRequests(TestCase):
+
+    def setUp(self):
+        self.spider = Spider.objects.create(module='scratchy_test.spider')
+
+    def middleware(self, cls=SeenRequestMiddleware, **kwargs):
+        middleware = cls(
+            spider_id=self.spider.id,
+            fingerprint=lambda request: request.url,
+            callbacks=['parse_detail'],
+            stats=mock.Mock(),
+            **kwargs,
+        )
+        if cls.preload:
+            middleware.spider_opened(None)
+        return middleware
+
+    def seen(self, url, age=timedelta(0), **kwargs):
+        SeenRequest.objects.create(spider=self.spider, fingerprint=url, url=url, time_seen=now() - age, **kwargs)
+
+    def test_skip(self):
+        self.seen('http://example.com/1')
+        middleware = self.middleware()
+
+        with self.assertRaises(IgnoreRequest):
+            middleware.process_request(Request('http://example.com/1', callback=parse_detail), None)
+        self.assertIsNone(middleware.process_request(Request('http://example.com/2', callback=parse_detail), None))
+        self.assertIsNone(middleware.process_request(Request('http://example.com/1', callback=parse_list), None))
+        self.assertIsNone(middleware.process_request(Request('http://example.com/1', callback=parse_detail, dont_filter=True), None))
+        request = Request('http://example.com/1', callback=parse_list, meta={'scratchy_seen': True})
+        with self.assertRaises(IgnoreRequest):
+            middleware.process_request(request, None)
+
+    def test_ttl(self):
+        self.seen('http://example.com/old', age=timedelta(hours=2), etag='"v1"')
+        self.seen('http://example.com/new', age=timedelta(minutes=5))
+        middleware = self.middleware(ttl=3600)
+
+        request = Request('http://example.com/old', callback=parse_detail)
+        self.assertIsNone(middleware.process_request(request, None))
+        self.assertNotIn(b'If-None-Match', request.headers)
+        with self.assertRaises(IgnoreRequest):
+            middleware.process_request(Request('http://example.com/new', callback=parse_detail), None)
+
+    def test_revalidate(self):
+        self.seen('http://example.com/old', age=timedelta(hours=2), etag='"v1"', last_modified='Mon, 01 Jan 2024 00:00:00 GMT')
+        middleware = self.middleware(ttl=3600, revalidate=True)
+
+        request = Request('http://example.com/old', callback=parse_detail)
+        self.assertIsNone(middleware.process_request(request, None))
+        self.assertEqual(request.headers['If-None-Match'], b'"v1"')
+        self.assertEqual(request.headers['If-Modified-Since'], b'Mon, 01 Jan 2024 00:00:00 GMT')
+
+        with self.assertRaises(IgnoreRequest):
+            middleware.process_response(request, Response(request.url, status=304, request=request), None)
+        middleware.spider_closed(None)
+
+        seen = SeenRequest.objects.get(spider=self.spider, fingerprint='http://example.com/old')
+        self.assertGreater(seen.time_seen, now() - timedelta(minutes=1))
+        self.assertEqual(seen.etag, '"v1"')
+
+        response = Response(request.url, status=200, request=request)
+        self.assertIs(middleware.process_response(request, response, None), response)
+
+    def test_record_after_callback(self):
+        middleware = self.middleware(SeenRequestSpiderMiddleware)
+
+        def failing():
+            yield {'item': 1}
+            raise ValueError
+
+        failed = Request('http://example.com/failed', callback=parse_detail)
+        with self.assertRaises(ValueError):
+            list(middleware.process_spider_output(Response(failed.url, request=failed), failing(), None))
+        done = Request('http://example.com/done', callback=parse_detail)
+        self.assertEqual(
+            list(middleware.process_spider_output(Response(done.url, request=done), iter([{'item': 2}]), None)),
+            [{'item': 2}],
+        )
+        listing = Request('http://example.com/list', callback=parse_list)
+        list(middleware.process_spider_output(Response(listing.url, request=listing), iter([]), None))
+        middleware.spider_closed(None)
+
+        self.assertEqual(list(SeenRequest.objects.values_list('url', flat=True)), ['http://example.com/done'])
+
+
+@skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+class TestArrowSchema(TestCase):
+
+    def test_type_widening(self):
+        import pyarrow as pa
+
+        spider = Spider.objects.create(module='scratchy_test.spider')
+        execution = Execution.objects.create(spider=spider, time_started=now())
+        data = [
+            {'integer': 1, 'number': 1, 'mixed': 1, 'null': None, 'large': 2 ** 70, 'flag': True, 'tags': ['a']},
+            {'integer': 2, 'number': 1.5, 'mixed': 'a', 'null': None, 'large': 1, 'flag': False, 'tags': None},
+        ]
+        Item.objects.bulk_create([Item(spider=spider, execution=execution, data=d) for d in data])
+
+        schema = get_arrow_schema(execution)
+
+        self.assertEqual(schema.field('integer').type, pa.int64())
+        self.assertEqual(schema.field('number').type, pa.float64())
+        self.assertEqual(schema.field('mixed').type, pa.string())
+        self.assertEqual(schema.field('null').type, pa.null())
+        self.assertEqual(schema.field('large').type, pa.float64())
+        self.assertEqual(schema.field('flag').type, pa.bool_())
+        self.assertEqual(schema.field('tags').type, pa.string())
+        self.assertEqual(execution.items_as_arrow().num_rows, 2)
+
+
+class TestRebuildCounters(TestCase):
+
+    def test_rebuild(self):
+        spider = Spider.objects.create(module='scratchy_test.spider')
+        first = Execution.objects.create(spider=spider, time_started=now(), time_ended=now(), stats={'finish_reason': 'finished'})
+        Execution.objects.create(spider=spider, time_started=now())  # running, counted when it ends
+        Execution.objects.create(spider=spider, time_queued=now())
+        Item.objects.bulk_create([Item(spider=spider, execution=first, data={'n': n}) for n in range(3)])
+
+        call_command('rebuild_scratchy_counters', stdout=io.StringIO())
+
+        first.refresh_from_db()
+        spider.refresh_from_db()
+        self.assertEqual(first.item_count, 3)
+        self.assertEqual(spider.execution_count, 1)
+        self.assertEqual(spider.last_execution, first)
+        self.assertEqual(spider.last_finish_reason, 'finished')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'COPY requires PostgreSQL')
+class TestCopyItems(TestCase):
+
+    def test_copy_matches_bulk_create(self):
+        spider = Spider.objects.create(module='scratchy_test.spider')
+        execution = Execution.objects.create(spider=spider, time_started=now())
+        data = [
+            {'text': 'a, "quoted"\nmulti-line\r\nvalue', 'backslash': 'C:\\path', 'unicode': 'caf\u00e9 \u2603'},
+            {'nested': {'list': [1, 'two', None], 'empty': ''}, 'number': 1.5, 'flag': False},
+            {'null': None, 'empty': '', 'comma': ','},
+        ]
+
+        for method, target in [('bulk_create', execution), (COPY, execution), ('bulk_create', None), (COPY, None)]:
+            items = [Item(spider=spider, execution=target, data=d, processed=method == COPY) for d in data]
+            save_items(items, method=method)
+
+        saved = Item.objects.order_by('id').values_list('execution_id', 'data', 'processed')
+        by_method = [list(saved[i:i + 3]) for i in range(0, 12, 3)]
+        expected = [(execution.id, d) for d in data]
+        self.assertEqual([(e, d) for e, d, _ in by_method[0]], expected)
+        self.assertEqual([(e, d) for e, d, _ in by_method[1]], expected)
+        self.assertEqual([(e, d) for e, d, _ in by_method[2]], [(None, d) for d in data])
+        self.assertEqual([(e, d) for e, d, _ in by_method[3]], [(None, d) for d in data])
+        self.assertEqual([p for _, _, p in by_method[1]], [True] * 3)
+        self.assertFalse(Item.objects.filter(time_created__isnull=True).exists())
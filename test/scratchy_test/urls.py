@@ -14,11 +14,13 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
 from . import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('scratchy/', include('scratchy.urls')),
+    path('bench/', include('scratchy_test.benchmark.site')),
     path('detail/<int:id>/', views.DetailView.as_view(), name='detail'),
     path('', views.IndexView.as_view(), name='index'),
 ]